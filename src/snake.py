@@ -18,9 +18,16 @@
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 #-----------------------------------------------------------------------
 
-import hpprime as h
-import graphic
-import urandom as random
+try:
+    import hpprime as h
+    import graphic
+    import urandom as random
+except ImportError: # off the calculator: a backend is plugged with use_backend(), see tools/
+    h = graphic = random = None
+try:
+    from time import ticks_us # microsecond clock of MicroPython, for the profiler
+except ImportError:
+    ticks_us = None
 
 # Constants
 SCREEN_W = 320
@@ -29,24 +36,54 @@ OFFSET_X = 10
 OFFSET_Y = 15
 
 # Global timer
-millis = 1000
+millis = 0 # monotonic clock at the start of the current loop iteration, ms
+MAX_FRAME_SKIP = 4 # renders skipped in a row at most when the logic falls behind
+MAX_CATCH_UP = 10 # ticks of delay after which the clock is resynced instead of caught up
+INPUT_QUEUE_LEN = 4 # key presses buffered between two logic ticks
 
 # Global score for the game - (high scores are shared between game modes)
 score = 0
+high_score = None # HighScore store of the current settings, loaded at launch
 
 # Settings
 GAME_DIMENSIONS = 3 # 2D or 3D
 SHADOWS_EN = 0 # 0 - no shadows, 1 - only on floor, 2 - on floor and walls
+SHADOWS_3D = 0 # shadows picked for the 3D mode, SHADOWS_EN follows it in 3D and is 0 in Classic
 FILLING_STEPS = 10 # more is fuller, less is faster
+SCANLINE_FILL = 1 # 0 - FILLING_STEPS diagonal lines per quad, 1 - one span per pixel row: no gaps, no overdraw
 PERIMETERS = 2 # 0 - no perimeters, 1 - only prey's, 2 - snake and prey
 MAP_SIZE = 2 # 1 - small , 2 - medium, 3 - large
 SF = MAP_SIZE # scaling factor
 GAME_SPEED = 2 # 1 - slow, 2 - medium, 3 - fast
+QUICK_START = 0 # 0 - settings menu at each launch, 1 - start with the saved profile
 BASE_REFRESH_T_MS = 1000
 SNAKE_COLOR = 0x00FF00
 SNAKE_OUTLINE_COLOR = 0x000000
 PREY_COLOR = 0xFF00FF
 PREY_OUTLINE_COLOR = 0xFFFFFF
+DIRTY_RENDER = 1 # 0 - full redraw every tick, 1 - redraw only the changed screen regions
+SCRATCH_G = 2 # offscreen GROB where dirty regions are recomposed
+CULLING_EN = 1 # skip the cubes and edges that a cube drawn later redraws line for line
+BACKGROUND_G = 4 # offscreen GROB holding the static scenery: floor grid and bounding cube
+SPRITES_EN = 1 # 0 - rasterise every cube, 1 - blit cubes from a cache of pre-rendered sprites
+SPRITE_G = 3 # offscreen GROB holding the cube sprites
+SPRITE_SLOTS = 32 # cube appearances kept in the cache, the oldest one is evicted when full
+SPRITE_KEY = 0x0A0B0C # transparent color of the sprites
+SCORE_BOX = (10, 10, 110, 24) # screen areas covered by the HUD texts
+HISCORE_BOX = (10, 215, 130, 229)
+ANIM_TIME_S = 0.5 # pacing of the game over / win animation, whatever the map size
+ANIM_COLORS = 6 # random colors of the win animation, few enough to stay in the sprite cache
+PROFILE_EN = 0 # 0 - off, 1 - time the phases of each tick, 2 - also show the times on screen
+PROFILE_WINDOW = 32 # ticks the rolling min / mean / max of the profiler are taken over
+profiler = None # Profiler of the running game, when PROFILE_EN
+REPLAY_EN = 0 # 1 - record the keys of the session in REPLAY_FILE, to play it again with tools/replay.py
+REPLAY_FILE = "snake3d.rpl"
+
+PHASE_NAMES = ("input", "move", "spawn", "buffer", "anim", "rects", "backgr", "perim", "shadows", "cubes", "hud", "present")
+PH_INPUT, PH_MOVE, PH_SPAWN, PH_BUFFER, PH_ANIM, PH_RECTS, PH_BACKGROUND, PH_PERIMETERS, PH_SHADOWS, PH_CUBES, PH_HUD, PH_PRESENT = range(12)
+# per tick counts kept by the profiler besides the phases: faces and edges culled, shadow fills made and
+# without the merging, logic, render and slack ms of the calculator loop
+COUNTER_NAMES = ("culled", "edges", "fills", "naive", "logic", "render", "slack")
 
 MIN_X, MIN_Y, MIN_Z = 5 * SF, -2 * SF, -2 * SF # Isometric Settings
 MAX_X, MAX_Y, MAX_Z = 13 * SF, 5 * SF, 2 * SF
@@ -54,7 +91,7 @@ TILE_W = 20 / SF
 TILE_H = 10 / SF
 
 def show_settings_menu():
-    global GAME_DIMENSIONS, SHADOWS_EN, FILLING_STEPS, PERIMETERS, MAP_SIZE, SF, GAME_SPEED
+    global GAME_DIMENSIONS, SHADOWS_3D, FILLING_STEPS, PERIMETERS, MAP_SIZE, SF, GAME_SPEED, QUICK_START
     
     # game dimensions
     h.eval("N := " + str(GAME_DIMENSIONS - 1))
@@ -64,34 +101,57 @@ def show_settings_menu():
 
     # shadows
     if GAME_DIMENSIONS > 2:
+        h.eval("N := " + str(SHADOWS_3D + 1))
         res = h.eval('CHOOSE(N, "Shadows", "None", "Floor only", "Floor and walls")')
         if res: 
-            SHADOWS_EN = int(h.eval("N")) - 1
+            SHADOWS_3D = int(h.eval("N")) - 1
     
     # map size
+    h.eval("N := " + str(MAP_SIZE))
     res = h.eval('CHOOSE(N, "Map size", "Small", "Normal", "Large")')
     if res:
-        choice = int(h.eval("N"))
-        MAP_SIZE = choice
-        SF = MAP_SIZE
-        # Update dependent globals
-        global MIN_X, MIN_Y, MIN_Z, MAX_X, MAX_Y, MAX_Z, TILE_W, TILE_H
-        MIN_X, MIN_Y, MIN_Z = 5 * SF, -2 * SF, ((-2 * SF) if GAME_DIMENSIONS == 3 else 0)
-        MAX_X, MAX_Y, MAX_Z = 13 * SF, 5 * SF, ((2 * SF) if GAME_DIMENSIONS == 3 else 1)
-        TILE_W = int(20 / SF)
-        TILE_H = int(10 / SF)
+        MAP_SIZE = int(h.eval("N"))
 
     # game speed
     h.eval("N := " + str(GAME_SPEED))
-    if MAP_SIZE < 3:
-        res = h.eval('CHOOSE(N, "Game speed", "Slow", "Normal", "Fast")')
-    else:
-        res = h.eval('CHOOSE(N, "Game speed", "Slow", "Normal")')
+    res = h.eval('CHOOSE(N, "Game speed", "Slow", "Normal", "Fast")')
     if res: GAME_SPEED = int(h.eval("N"))
-           
+
+    # next launch
+    h.eval("N := " + str(QUICK_START + 1))
+    res = h.eval('CHOOSE(N, "Next launch", "Show this menu", "Start straight away")')
+    if res: QUICK_START = int(h.eval("N")) - 1
+
+    apply_settings()
+
+def apply_settings():
+    # Recompute every global derived from the settings in one pass. The tables built on them
+    # (projection, palette, sprites, background) follow when the World is created
+    global SHADOWS_EN, SF, MIN_X, MIN_Y, MIN_Z, MAX_X, MAX_Y, MAX_Z, TILE_W, TILE_H
+    SHADOWS_EN = SHADOWS_3D if GAME_DIMENSIONS == 3 else 0 # no shadows in Classic
+    SF = MAP_SIZE
+    MIN_X, MIN_Y, MIN_Z = 5 * SF, -2 * SF, ((-2 * SF) if GAME_DIMENSIONS == 3 else 0)
+    MAX_X, MAX_Y, MAX_Z = 13 * SF, 5 * SF, ((2 * SF) if GAME_DIMENSIONS == 3 else 1)
+    TILE_W = int(20 / SF)
+    TILE_H = int(10 / SF)
+
+def use_backend(hp, rng):
+    # Route the calls made to hpprime (line, fillrect, blit, dimgrob, eval) and urandom (randint)
+    # to other implementations of them, to run the game off the calculator
+    global h, random
+    h, random = hp, rng
+
 def wait(t_s):
     h.eval('WAIT({})'.format(t_s))
 
+def ticks_ms():
+    return int(h.eval('TICKS'))
+
+def clock_us():
+    if ticks_us:
+        return ticks_us()
+    return ticks_ms() * 1000
+
 def get_hiscore_var_name():
     d = str(GAME_DIMENSIONS) + "D"
     s = ["S", "M", "L"][MAP_SIZE - 1]
@@ -112,22 +172,269 @@ def save_high_score(new_score):
     hiscore_var = get_hiscore_var_name()
     h.eval(hiscore_var + ":=" + str(int(new_score)))
 
+class HighScore():
+    # in-memory copy of the high score variable, written back only when a new record is set
+    def __init__(self):
+        self.value = get_high_score()
+        self.dirty = False
+        if self.value < 0: # init hiscore var if needed
+            self.value = 0
+            save_high_score(0)
+
+    def submit(self, new_score):
+        if new_score <= self.value:
+            return False
+        self.value = new_score
+        self.dirty = True
+        return True
+
+    def flush(self):
+        if self.dirty:
+            save_high_score(self.value)
+            self.dirty = False
+
+class Profiler():
+    # Time and calculator calls (lines, blits, fills and PPL commands) of each phase of the ticks, kept for
+    # the last PROFILE_WINDOW ticks. mark() charges the time since the previous mark to a phase. The call sites
+    # test the profiler global first, so that switched off it costs a lookup per phase. commit() also logs
+    # the COUNTER_NAMES of the tick
+    VAR_NAME = "SNAKE3D_PROF"
+
+    def __init__(self, world):
+        self.world = world
+        n = len(PHASE_NAMES)
+        self.us = [0] * n # current tick
+        self.calls = [0] * n
+        self.us_log = [[0] * PROFILE_WINDOW for i in range(n)] # rolling window of each phase
+        self.calls_log = [[0] * PROFILE_WINDOW for i in range(n)]
+        self.counts_log = [[0] * PROFILE_WINDOW for i in range(len(COUNTER_NAMES))]
+        self.ticks = 0
+        self.t = 0
+        self.c = 0
+
+    def count(self):
+        # calls made through the World's counted wrappers, the profiler's own clock reads excluded
+        w = self.world
+        return w.line_count + w.blit_count + w.fill_count + w.eval_count
+
+    def begin(self):
+        self.c = self.count()
+        self.t = clock_us()
+
+    def mark(self, phase):
+        t = clock_us()
+        c = self.count()
+        self.us[phase] += max(t - self.t, 0) # the microsecond clock wraps around
+        self.calls[phase] += max(c - self.c, 0)
+        self.t, self.c = t, c
+
+    def commit(self, logic_ms=0, render_ms=0, slack_ms=0):
+        # end of a tick, with the loop times when the calculator loop runs it
+        i = self.ticks % PROFILE_WINDOW
+        for p in range(len(PHASE_NAMES)):
+            self.us_log[p][i] = self.us[p]
+            self.calls_log[p][i] = self.calls[p]
+            self.us[p] = 0
+            self.calls[p] = 0
+        w = self.world
+        counts = (w.culled_faces, w.culled_edges, w.shadow_fills, w.shadow_fills_naive, logic_ms, render_ms, slack_ms)
+        for k in range(len(COUNTER_NAMES)):
+            self.counts_log[k][i] = counts[k]
+        self.ticks += 1
+
+    def stats(self, phase):
+        # min, mean, max us and mean calls over the window
+        n = min(self.ticks, PROFILE_WINDOW)
+        if not n:
+            return (0, 0, 0, 0)
+        us = self.us_log[phase][:n]
+        return (min(us), sum(us) // n, max(us), sum(self.calls_log[phase][:n]) // n)
+
+    def counter_stats(self, k):
+        # min, mean, max of a counter over the window
+        n = min(self.ticks, PROFILE_WINDOW)
+        if not n:
+            return (0, 0, 0)
+        counts = self.counts_log[k][:n]
+        return (min(counts), sum(counts) // n, max(counts))
+
+    def report(self):
+        # compact log, one "phase:min/mean/max/calls" field per phase then one "counter:min/mean/max" per counter
+        return ";".join(["{}:{}/{}/{}/{}".format(PHASE_NAMES[p], *self.stats(p)) for p in range(len(PHASE_NAMES))] +
+                        ["{}:{}/{}/{}".format(COUNTER_NAMES[k], *self.counter_stats(k)) for k in range(len(COUNTER_NAMES))])
+
+    def draw(self):
+        # ms min / mean / max and calls of each phase, over the frame just presented on G0
+        for p in range(len(PHASE_NAMES)):
+            lo, mean, hi, calls = self.stats(p)
+            text = "{} {:.1f} {:.1f} {:.1f} {}".format(PHASE_NAMES[p], lo / 1000, mean / 1000, hi / 1000, calls)
+            h.eval('TEXTOUT_P("' + text + '", G0, 200, ' + str(30 + 12 * p) + ', 1, 65535, 120, 0)')
+
+class XorShift():
+    # Random generator giving the same numbers on the calculator and on a computer, so that a
+    # recorded session spawns its prey at the same places when played again
+    def __init__(self, seed):
+        self.state = (seed & 0xFFFFFFFF) or 1
+
+    def randint(self, a, b):
+        x = self.state
+        x ^= (x << 13) & 0xFFFFFFFF
+        x ^= x >> 17
+        x ^= (x << 5) & 0xFFFFFFFF
+        self.state = x
+        return a + x % (b - a + 1)
+
+class Replay():
+    # Session record: header, one byte per tick for the key consumed by Game.update (0 for none),
+    # footer with the final score and state. The seed is the one of the XorShift generator
+    #   "S3D" version(1) seed(4) dimensions shadows map_size speed perimeters | keys... | score(2) state(1)
+    MAGIC = b"S3D"
+    VERSION = 1
+    HEADER = 13
+    FOOTER = 3
+
+    def __init__(self, seed, settings):
+        self.seed = seed & 0xFFFFFFFF # the seed XorShift keeps, so that any seed fits the record
+        self.settings = settings # (GAME_DIMENSIONS, SHADOWS_EN, MAP_SIZE, GAME_SPEED, PERIMETERS)
+        self.keys = bytearray()
+        self.score = 0
+        self.state = 0
+
+    def add(self, key):
+        self.keys.append(key if 0 < key < 256 else 0)
+
+    def to_bytes(self):
+        return (Replay.MAGIC + bytes([Replay.VERSION]) + self.seed.to_bytes(4, "big") + bytes(self.settings)
+                + bytes(self.keys) + self.score.to_bytes(2, "big") + bytes([self.state]))
+
+    @staticmethod
+    def from_bytes(data):
+        if data[:3] != Replay.MAGIC or data[3] != Replay.VERSION or len(data) < Replay.HEADER + Replay.FOOTER:
+            raise ValueError("not a Snake3D replay")
+        replay = Replay(int.from_bytes(data[4:8], "big"), tuple(data[8:13]))
+        replay.keys = bytearray(data[Replay.HEADER:len(data) - Replay.FOOTER])
+        replay.score = int.from_bytes(data[-3:-1], "big")
+        replay.state = data[-1]
+        return replay
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as f:
+            return Replay.from_bytes(f.read())
+
+def cell_index(p):
+    width = MAX_X - MIN_X
+    height = MAX_Y - MIN_Y
+    return (p[0] - MIN_X) + (p[1] - MIN_Y) * width + (p[2] - MIN_Z) * width * height
+
+def cell_coords(idx):
+    width = MAX_X - MIN_X
+    height = MAX_Y - MIN_Y
+    rem = idx % (width * height)
+    return (rem % width + MIN_X, rem // width + MIN_Y, idx // (width * height) + MIN_Z)
+
+def cell_count():
+    return (MAX_X - MIN_X) * (MAX_Y - MIN_Y) * (MAX_Z - MIN_Z)
+
+def bisect(items, value):
+    # position of value in the sorted list items, or where to insert it
+    lo, hi = 0, len(items)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if items[mid] < value:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+class CellSet():
+    # set of cell indices kept in a preallocated array, O(1) add/remove by swapping with the last item
+    def __init__(self, size):
+        self.items = list(range(size))
+        self.pos = list(range(size)) # index of each cell in items, -1 if not in the set
+        self.count = size
+
+    def __contains__(self, idx):
+        return self.pos[idx] >= 0
+
+    def add(self, idx):
+        if self.pos[idx] < 0:
+            self.items[self.count] = idx
+            self.pos[idx] = self.count
+            self.count += 1
+
+    def remove(self, idx):
+        k = self.pos[idx]
+        if k < 0:
+            return
+        self.count -= 1
+        last = self.items[self.count]
+        self.items[k] = last
+        self.pos[last] = k
+        self.items[self.count] = idx
+        self.pos[idx] = -1
+
+    def pick(self):
+        return self.items[random.randint(0, self.count - 1)]
+
 class Snake():
     def __init__(self):
         self.size = 2
         self.outline = SNAKE_OUTLINE_COLOR
         self.color = SNAKE_COLOR
         self.velocity = [1, 0, 0]
-        self.body = [[MIN_X, MIN_Y, 0], [MIN_X + 1, MIN_Y, 0]]
+        total = cell_count()
+        self.ring = [0] * (total + 2) # body as packed cell indices, from tail to head, sized for a full grid
+        self.start = 0 # ring position of the tail
+        self.vacated = -1 # cell index left by the tail on the last move
+        self.pos = [MIN_X + 1, MIN_Y, 0] # head coordinates
+        self.cells = bytearray(total) # body segments covering each cell, indexed by cell_index()
+        self.free = CellSet(total) # cells not covered by the body, kept for the prey spawn
+        self.ring[0] = cell_index([MIN_X, MIN_Y, 0])
+        self.ring[1] = cell_index(self.pos)
+        for i in range(self.size):
+            self.occupy(self.ring[i])
         
+    def occupy(self, idx):
+        if not self.cells[idx]:
+            self.free.remove(idx)
+        self.cells[idx] += 1
+
+    def release(self, idx):
+        self.cells[idx] -= 1
+        if not self.cells[idx]:
+            self.free.add(idx)
+
+    def collided(self):
+        # the head shares its cell with another segment
+        return self.cells[self.head_cell()] > 1
+
     def head(self):
-        return self.body[-1]
+        return self.pos
 
     def tail(self):
-        return self.body[0]
+        return cell_coords(self.tail_cell())
+
+    def head_cell(self):
+        return self.ring[(self.start + self.size - 1) % len(self.ring)]
+
+    def tail_cell(self):
+        return self.ring[self.start]
+
+    def segments(self):
+        # packed cell indices from tail to head
+        ring, n = self.ring, len(self.ring)
+        for i in range(self.start, self.start + self.size):
+            yield ring[i % n]
     
     def move(self):
-        new_head = [self.head()[i] + self.velocity[i] for i in range(3)]
+        new_head = self.pos
+        for i in range(3):
+            new_head[i] += self.velocity[i]
         if new_head[0] > MAX_X-1:
             new_head[0] = MIN_X
         if new_head[1] > MAX_Y-1:
@@ -140,11 +447,19 @@ class Snake():
             new_head[1] = MAX_Y-1
         if new_head[2] < MIN_Z:
             new_head[2] = MAX_Z-1
-        self.body.pop(0)
-        self.body.append(new_head)
+        self.vacated = self.ring[self.start]
+        self.release(self.vacated)
+        self.start = (self.start + 1) % len(self.ring)
+        idx = cell_index(new_head)
+        self.ring[(self.start + self.size - 1) % len(self.ring)] = idx
+        self.occupy(idx)
 
     def grow(self):
-        self.body.insert(0, self.tail())
+        idx = self.ring[self.start]
+        self.start = (self.start - 1) % len(self.ring)
+        self.ring[self.start] = idx
+        self.size += 1
+        self.occupy(idx)
 
 class Prey():
     color = PREY_COLOR
@@ -155,11 +470,6 @@ class Prey():
         self.spawn(None)
 
     def spawn(self, snake):
-        width = MAX_X - MIN_X
-        height = MAX_Y - MIN_Y
-        depth = MAX_Z - MIN_Z
-        total_cells = width * height * depth
-
         if not snake:
             self.body = [
                 random.randint(MIN_X, MAX_X-1), 
@@ -167,42 +477,168 @@ class Prey():
                 random.randint(MIN_Z, MAX_Z-1)]
             return
 
-        occupied_indices = set()
-        for p in snake.body:
-            idx = (p[0] - MIN_X) + (p[1] - MIN_Y) * width + (p[2] - MIN_Z) * width * height
-            occupied_indices.add(idx)
-
-        all_indices = range(total_cells)
-        allowed_indices = [i for i in all_indices if i not in occupied_indices]
-
-        if not allowed_indices:
+        if not snake.free.count:
             self.body = [] # WIN
             return
 
-        choice = random.choice(allowed_indices)
-        
-        z = choice // (width * height)
-        rem = choice % (width * height)
-        y = rem // width
-        x = rem % width
+        x, y, z = cell_coords(snake.free.pick())
+        if len(self.body) == 3:
+            self.body[0], self.body[1], self.body[2] = x, y, z
+        else:
+            self.body = [x, y, z]
 
-        self.body = [x + MIN_X, y + MIN_Y, z + MIN_Z]
+HIDDEN_CUBE = -1 # World.hidden_edges results
+EDGE_TOP_RIGHT = 1 # p2-p3
+EDGE_TOP_LEFT = 2 # p3-p4
+EDGE_FRONT = 4 # p3-p3_b
 
 class World():
     def __init__(self):
-        self.main_buffer = {} 
-
-    def iso_to_2d(self, x, y, z):
+        self.main_buffer = {} # entities keyed by packed cell index
+        self.order = [] # keys of main_buffer, sorted: the back to front drawing order
+        self.dirty_cells = [] # cells whose entity changed since the last render
+        self.snake_entity = [SNAKE_COLOR, SNAKE_OUTLINE_COLOR]
+        self.prey_entity = [PREY_COLOR, PREY_OUTLINE_COLOR]
+        self.prey_idx = -1
+        self.snake = None # occupancy grid of the buffered snake, for the culling
+        self.grob = 1 # GROB targeted by the draw calls
+        self.clip = None # (x1, y1, x2, y2) screen region being recomposed, None for the full frame
+        self.line_count = 0 # h.line calls issued by the last render
+        self.blit_count = 0 # h.blit calls issued by the last render
+        self.fill_count = 0 # h.fillrect calls issued by the last render
+        self.eval_count = 0 # h.eval calls issued by the last render and the input polls: texts, keys
+        self.culled_faces = 0 # cube faces skipped by the last render, 3 per hidden cube
+        self.culled_edges = 0
+        self.shadow_fills = 0 # shadow quads filled by the last render
+        self.shadow_fills_naive = 0 # the same with one fill per entity and plane
+        self.full_redraw = True
+        self.prev_perimeters = None
+        self.prev_score = -1
+        self.score_key = None # (score, grob) of the cached HUD commands
+        self.hiscore_key = None
+        self.build_projection()
+        self.build_palette()
+        self.reset_sprites() # sprites and background depend on the tile size: rebuild them along with the projection
+        self.build_background()
+
+    def project(self, x, y, z):
         sx = OFFSET_X + (x - y) * TILE_W
         sy = OFFSET_Y + (x + y) * TILE_H - (z * TILE_H * 2)
         return (int(sx), int(sy))
+
+    def build_projection(self):
+        # screen coordinates of every lattice vertex of the MIN..MAX box, x fastest then y then z.
+        # One shared 2-tuple per vertex, about 20 bytes each: 360/144 vertices (7/3 KB) on the
+        # small 3D/2D map, 2295/510 (46/10 KB) on the normal one, 7150/1100 (143/22 KB) on the large one
+        self.stride_y = MAX_X - MIN_X + 1
+        self.stride_z = self.stride_y * (MAX_Y - MIN_Y + 1)
+        self.proj = [None] * (self.stride_z * (MAX_Z - MIN_Z + 1))
+        i = 0
+        for z in range(MIN_Z, MAX_Z + 1):
+            for y in range(MIN_Y, MAX_Y + 1):
+                for x in range(MIN_X, MAX_X + 1):
+                    self.proj[i] = self.project(x, y, z)
+                    i += 1
+
+    def vertex(self, x, y, z):
+        # index of a lattice vertex in the projection table
+        return (x - MIN_X) + (y - MIN_Y) * self.stride_y + (z - MIN_Z) * self.stride_z
+
+    def iso_to_2d(self, x, y, z):
+        return self.proj[(x - MIN_X) + (y - MIN_Y) * self.stride_y + (z - MIN_Z) * self.stride_z]
     
     def load_buffer(self, snake: Snake, prey: Prey):
+        # full rebuild, for a new game
+        self.snake_entity = [snake.color, snake.outline]
+        self.prey_entity = [prey.color, prey.outline]
+        self.snake = snake
         self.main_buffer = {}
-        for snake_block in snake.body:
-            self.main_buffer[tuple(snake_block)] = [snake.color, snake.outline]
+        for idx in snake.segments():
+            self.main_buffer[idx] = self.snake_entity
+
+        self.prey_idx = cell_index(prey.body) if prey.body else -1
+        if self.prey_idx >= 0:
+            self.main_buffer[self.prey_idx] = self.prey_entity
+        self.order = sorted(self.main_buffer)
+        self.dirty_cells = []
+        self.full_redraw = True
+
+    def update_buffer(self, snake: Snake, prey: Prey):
+        # a tick only changes the entered head cell, the vacated tail cell and the prey cells
+        prey_idx = cell_index(prey.body) if prey.body else -1
+        old_prey, self.prey_idx = self.prey_idx, prey_idx
+        for idx in (snake.vacated, snake.head_cell(), old_prey, prey_idx):
+            self.refresh_cell(idx, snake)
+
+    def refresh_cell(self, idx, snake):
+        if idx < 0:
+            return
+        if idx == self.prey_idx:
+            entity = self.prey_entity
+        elif snake.cells[idx]:
+            entity = self.snake_entity
+        else:
+            entity = None
+        old = self.main_buffer.get(idx)
+        if old is entity:
+            return
+
+        self.dirty_cells.append(idx)
+        if entity is None:
+            del self.main_buffer[idx]
+            self.order.pop(bisect(self.order, idx))
+            return
+        if old is None:
+            self.order.insert(bisect(self.order, idx), idx)
+        self.main_buffer[idx] = entity
+
+    def line(self, x1, y1, x2, y2, color):
+        c = self.clip
+        if c:
+            if max(x1, x2) < c[0] or min(x1, x2) > c[2] or max(y1, y2) < c[1] or min(y1, y2) > c[3]:
+                return # outside of the region being recomposed
+            # skip the diagonals passing beside the region - all its corners on the same side
+            dx, dy = x2 - x1, y2 - y1
+            s1 = dx * (c[1] - 1 - y1) - dy * (c[0] - 1 - x1)
+            s2 = dx * (c[1] - 1 - y1) - dy * (c[2] + 1 - x1)
+            s3 = dx * (c[3] + 1 - y1) - dy * (c[0] - 1 - x1)
+            s4 = dx * (c[3] + 1 - y1) - dy * (c[2] + 1 - x1)
+            if (s1 > 0 and s2 > 0 and s3 > 0 and s4 > 0) or (s1 < 0 and s2 < 0 and s3 < 0 and s4 < 0):
+                return
+        self.line_count += 1
+        h.line(self.grob, x1, y1, x2, y2, color)
+
+    def blit(self, dx, dy, src, sx1, sy1, sx2, sy2, c):
+        self.blit_count += 1
+        h.blit(self.grob, dx, dy, src, sx1, sy1, sx2, sy2, c)
+
+    def copy(self, dst, src, r=None):
+        # the region r = (x1, y1, x2, y2) of src to the same place on dst, the whole GROB without r
+        self.blit_count += 1
+        if r is None:
+            h.blit(dst, 0, 0, src)
+        else:
+            h.blit(dst, r[0], r[1], src, r[0], r[1], r[2] + 1, r[3] + 1)
+
+    def fillrect(self, grob, x, y, w, hgt, edge, fill):
+        self.fill_count += 1
+        h.fillrect(grob, x, y, w, hgt, edge, fill)
+
+    def eval(self, cmd):
+        self.eval_count += 1
+        return h.eval(cmd)
+
+    def bbox(self, points):
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        return (min(xs) - 1, min(ys) - 1, max(xs) + 1, max(ys) + 1)
 
-        self.main_buffer[tuple(prey.body)] = [prey.color, prey.outline]
+    def hits(self, points):
+        if not self.clip:
+            return True
+        b = self.bbox(points)
+        c = self.clip
+        return b[0] <= c[2] and b[2] >= c[0] and b[1] <= c[3] and b[3] >= c[1]
 
     def draw_horizontal_perimeter(self, z, color_hex, outer_en):
         c1 = self.iso_to_2d(MIN_X, MIN_Y, z)
@@ -215,12 +651,22 @@ class World():
         if outer_en:
             points = [c1, c2, c3, c4, c1]
             for i in range(len(points)-1):
-                h.line(1, points[i][0], points[i][1], points[i+1][0], points[i+1][1], color_hex)
+                self.line(points[i][0], points[i][1], points[i+1][0], points[i+1][1], color_hex)
             return
 
         points = [c4, c1, c2] # just the back ones
         for i in range(len(points)-1):
-            h.line(1, points[i][0], points[i][1], points[i+1][0], points[i+1][1], color_hex)
+            self.line(points[i][0], points[i][1], points[i+1][0], points[i+1][1], color_hex)
+
+    def perimeter_levels(self, game):
+        # (z, color) of the snake and prey z levels perimeters
+        if PERIMETERS == 0 or GAME_DIMENSIONS < 3:
+            return ()
+        if game.snake.head()[2] == game.prey.body[2]:
+            return ((game.snake.head()[2], 0x0000FF),)
+        if PERIMETERS == 2:
+            return ((game.snake.head()[2], 0x00FF00), (game.prey.body[2], 0xFF00FF))
+        return ((game.prey.body[2], 0xFF00FF),)
 
     def draw_grid_cube(self):
         b1 = self.iso_to_2d(MIN_X, MIN_Y, MIN_Z) # bottom face
@@ -249,45 +695,170 @@ class World():
 
         # draw the lines
         for p1, p2 in edges:
-            h.line(1, p1[0], p1[1], p2[0], p2[1], 0xFFFFFF)
-
-    def draw_cube(self, center_xyz, color, outlines_en):
+            self.line(p1[0], p1[1], p2[0], p2[1], 0xFFFFFF)
+
+    def cube_points(self, x, y, z):
+        pr, sy, sz = self.proj, self.stride_y, self.stride_z
+        i = self.vertex(x, y, z)
+        return (
+            pr[i + sz], # top face vertices
+            pr[i + 1 + sz],
+            pr[i + 1 + sy + sz],
+            pr[i + sy + sz],
+            pr[i + 1], # bottom face vertices
+            pr[i + 1 + sy],
+            pr[i + sy])
+
+    def filled(self, x, y, z):
+        # the snake's occupancy grid, the one of the collision test, or the prey cell
+        if x >= MAX_X or y >= MAX_Y or z >= MAX_Z:
+            return False
+        idx = cell_index((x, y, z))
+        return self.snake.cells[idx] > 0 or idx == self.prey_idx
+
+    def hidden_edges(self, idx, x, y, z):
+        # Culling for the painter's pass, exact to the pixel whatever the rasteriser: only what a cube
+        # drawn later repeats with the very same lines is skipped. The cube at (x+k, y+k, z+k) projects on
+        # the same pixels, so it hides the whole cube. Above, (x, y, z+1) draws the two front top edges as
+        # its bottom edges, and the front vertical edge comes again with (x+1, y, z) or (x, y+1, z).
+        # Returns HIDDEN_CUBE or a mask of hidden edges
+        w = MAX_X - MIN_X
+        step = 1 + w + w * (MAX_Y - MIN_Y) # cell index step along the (1, 1, 1) diagonal
+        cells = self.snake.cells
+        for k in range(1, min(MAX_X - x, MAX_Y - y, MAX_Z - z)):
+            c = idx + k * step
+            if cells[c] or c == self.prey_idx:
+                return HIDDEN_CUBE
+        mask = 0
+        if self.filled(x, y, z + 1):
+            mask |= EDGE_TOP_RIGHT | EDGE_TOP_LEFT
+        if self.filled(x + 1, y, z) or self.filled(x, y + 1, z):
+            mask |= EDGE_FRONT
+        return mask
+
+    def shade(self, color, z):
+        if GAME_DIMENSIONS > 2:
+            return sum(int((color >> s & 0xFF) * (z - MIN_Z) / (MAX_Z - MIN_Z or 1)) << s for s in (16, 8, 0)) # right face - dimmed by z
+        return color & 0xB0B0B0
+
+    def build_palette(self):
+        # (top and left, right) face colors of the entity and game over colors at every level, so that
+        # drawing a cube costs a lookup instead of the shading arithmetic
+        self.palette = {}
+        for color in (SNAKE_COLOR, PREY_COLOR, 0xFF0000):
+            self.palette[color] = [(color, self.shade(color, z)) for z in range(MIN_Z, MAX_Z)]
+
+    def face_colors(self, color, z):
+        faces = self.palette.get(color)
+        if faces is None: # not in the table, like the random colors of the win animation
+            return (color, self.shade(color, z))
+        return faces[z - MIN_Z]
+
+    def draw_cube(self, center_xyz, color, outlines_en, hidden=0):
             x, y, z = center_xyz[0], center_xyz[1], center_xyz[2]
             
-            p1 = self.iso_to_2d(x, y, z + 1) # top face vertices
-            p2 = self.iso_to_2d(x + 1, y, z + 1)
-            p3 = self.iso_to_2d(x + 1, y + 1, z + 1)
-            p4 = self.iso_to_2d(x, y + 1, z + 1)
-            
-            p2_b = self.iso_to_2d(x + 1, y, z) # bottom face vertices
-            p3_b = self.iso_to_2d(x + 1, y + 1, z)
-            p4_b = self.iso_to_2d(x, y + 1, z)
+            points = self.cube_points(x, y, z)
+            if not self.hits(points):
+                return
 
-            self.fill_isometric_rect(p1, p2, p3, p4, color) # top face fill
-            
-            if GAME_DIMENSIONS > 2:
-                self.fill_isometric_rect(p2, p3, p3_b, p2_b, sum(int((color >> s & 0xFF) * (z - MIN_Z) / (MAX_Z - MIN_Z or 1)) << s for s in (16, 8, 0)))  # right face fill - dimmed by z
+            color, shade = self.face_colors(color, z)
+
+            if SPRITES_EN:
+                self.blit_sprite(points[0], color, shade, outlines_en)
             else:
-                self.fill_isometric_rect(p2, p3, p3_b, p2_b, color & 0xB0B0B0) # right face fill
-            self.fill_isometric_rect(p3, p4, p4_b, p3_b, color) # left face fill
+                self.raster_cube(points, color, shade, outlines_en, hidden)
 
-            out_col = 0xFFFF if outlines_en else 0x0000
-            
-            h.line(1, p1[0], p1[1], p2[0], p2[1], out_col) # top face edges
-            h.line(1, p2[0], p2[1], p3[0], p3[1], out_col)
-            h.line(1, p3[0], p3[1], p4[0], p4[1], out_col)
-            h.line(1, p4[0], p4[1], p1[0], p1[1], out_col)
-            
-            h.line(1, p2[0], p2[1], p2_b[0], p2_b[1], out_col) # vertical edges
-            h.line(1, p3[0], p3[1], p3_b[0], p3_b[1], out_col)
-            h.line(1, p4[0], p4[1], p4_b[0], p4_b[1], out_col)
-            
-            h.line(1, p2_b[0], p2_b[1], p3_b[0], p3_b[1], out_col) # bottom edges
-            h.line(1, p3_b[0], p3_b[1], p4_b[0], p4_b[1], out_col)
+    def raster_cube(self, points, color, shade, outlines_en, hidden=0):
+        p1, p2, p3, p4, p2_b, p3_b, p4_b = points
+
+        self.fill_isometric_rect(p1, p2, p3, p4, color) # top face fill
+        self.fill_isometric_rect(p2, p3, p3_b, p2_b, shade) # right face fill
+        self.fill_isometric_rect(p3, p4, p4_b, p3_b, color) # left face fill
+
+        out_col = 0xFFFF if outlines_en else 0x0000
+        
+        self.line(p1[0], p1[1], p2[0], p2[1], out_col) # top face edges
+        if not hidden & EDGE_TOP_RIGHT:
+            self.line(p2[0], p2[1], p3[0], p3[1], out_col)
+        if not hidden & EDGE_TOP_LEFT:
+            self.line(p3[0], p3[1], p4[0], p4[1], out_col)
+        self.line(p4[0], p4[1], p1[0], p1[1], out_col)
+        
+        self.line(p2[0], p2[1], p2_b[0], p2_b[1], out_col) # vertical edges
+        if not hidden & EDGE_FRONT:
+            self.line(p3[0], p3[1], p3_b[0], p3_b[1], out_col)
+        self.line(p4[0], p4[1], p4_b[0], p4_b[1], out_col)
+        
+        self.line(p2_b[0], p2_b[1], p3_b[0], p3_b[1], out_col) # bottom edges
+        self.line(p3_b[0], p3_b[1], p4_b[0], p4_b[1], out_col)
+
+    def reset_sprites(self):
+        # every cube is the same shape shifted on the screen: measure it on the first cell
+        ref = self.cube_points(MIN_X, MIN_Y, MIN_Z)
+        xs = [p[0] - ref[0][0] for p in ref]
+        ys = [p[1] - ref[0][1] for p in ref]
+        self.sprite_dx, self.sprite_dy = min(xs), min(ys) # sprite corner from the top vertex
+        self.sprite_w = max(xs) - min(xs) + 1
+        self.sprite_h = max(ys) - min(ys) + 1
+        self.sprite_ref = ref
+        self.sprite_cols = min(SPRITE_SLOTS, SCREEN_W // self.sprite_w)
+        slots = min(SPRITE_SLOTS, self.sprite_cols * (SCREEN_H // self.sprite_h))
+        rows = (slots + self.sprite_cols - 1) // self.sprite_cols
+
+        self.sprites = {} # (color, shade, outlines_en) -> atlas slot
+        self.sprite_keys = [None] * slots # atlas slot -> key, for the eviction
+        self.sprite_next = 0 # next slot to fill, in round robin: the oldest sprite is evicted first
+        h.dimgrob(SPRITE_G, self.sprite_cols * self.sprite_w, rows * self.sprite_h, SPRITE_KEY)
+
+    def blit_sprite(self, top, color, shade, outlines_en):
+        key = (color, shade, outlines_en)
+        slot = self.sprites.get(key)
+        sx, sy = 0, 0
+        if slot is None:
+            slot = self.sprite_next
+            self.sprite_next = (slot + 1) % len(self.sprite_keys)
+            if self.sprite_keys[slot] is not None:
+                del self.sprites[self.sprite_keys[slot]]
+            self.sprite_keys[slot] = key
+            self.sprites[key] = slot
+            sx = (slot % self.sprite_cols) * self.sprite_w
+            sy = (slot // self.sprite_cols) * self.sprite_h
+            self.render_sprite(sx, sy, color, shade, outlines_en)
+        else:
+            sx = (slot % self.sprite_cols) * self.sprite_w
+            sy = (slot // self.sprite_cols) * self.sprite_h
+        self.blit(top[0] + self.sprite_dx, top[1] + self.sprite_dy, SPRITE_G,
+                  sx, sy, sx + self.sprite_w, sy + self.sprite_h, SPRITE_KEY)
+
+    def render_sprite(self, sx, sy, color, shade, outlines_en):
+        ox = sx - self.sprite_dx - self.sprite_ref[0][0]
+        oy = sy - self.sprite_dy - self.sprite_ref[0][1]
+        points = [(p[0] + ox, p[1] + oy) for p in self.sprite_ref]
+
+        grob, clip = self.grob, self.clip
+        self.grob, self.clip = SPRITE_G, None
+        self.fillrect(SPRITE_G, sx, sy, self.sprite_w, self.sprite_h, SPRITE_KEY, SPRITE_KEY)
+        self.raster_cube(points, color, shade, outlines_en)
+        self.grob, self.clip = grob, clip
+
+    def build_background(self):
+        grob, clip = self.grob, self.clip
+        self.grob, self.clip = BACKGROUND_G, None
+        h.dimgrob(BACKGROUND_G, SCREEN_W, SCREEN_H, 0x000000)
+        self.draw_floor_grid()
+        self.draw_grid_cube()
+        self.grob, self.clip = grob, clip
+
+    def draw_background(self, grob):
+        self.copy(grob, BACKGROUND_G)
 
     def fill_isometric_rect(self, a, b, c, d, color):
         global FILLING_STEPS
         
+        if SCANLINE_FILL:
+            self.fill_scanlines((a, b, c, d), color)
+            return
+
         for i in range(FILLING_STEPS + 1):
             f = i / FILLING_STEPS
             # linear interpolation between points
@@ -295,124 +866,379 @@ class World():
             y_start = int(a[1] + (d[1] - a[1]) * f)
             x_end = int(b[0] + (c[0] - b[0]) * f)
             y_end = int(b[1] + (c[1] - b[1]) * f)
-            h.line(1, x_start, y_start, x_end, y_end, color)
+            self.line(x_start, y_start, x_end, y_end, color)
+
+    def fill_scanlines(self, quad, color):
+        # One span per pixel column for the faces with a vertical a-d side (cube sides, walls), one per
+        # pixel row for the others (tops, floor): always the short way across, and a quad stretched along
+        # a-b, such as a merged shadow run, keeps the axis and so the pixels of its cells
+        xs = (quad[0][0], quad[1][0], quad[2][0], quad[3][0])
+        ys = (quad[0][1], quad[1][1], quad[2][1], quad[3][1])
+        u = 0 if quad[0][0] == quad[3][0] else 1 # scanned axis, spans run along the other one
+        v = 1 - u
+        lo = max(min(xs if u == 0 else ys), 0)
+        hi = min(max(xs if u == 0 else ys), (SCREEN_H if u else SCREEN_W) - 1)
+        if self.clip:
+            lo, hi = max(lo, self.clip[u]), min(hi, self.clip[u + 2])
+        for t in range(lo, hi + 1):
+            s_min, s_max = SCREEN_W, -1
+            for i in range(4):
+                p, q = quad[i], quad[i - 1]
+                if (p[u] <= t <= q[u]) or (q[u] <= t <= p[u]):
+                    if p[u] == q[u]:
+                        s1, s2 = min(p[v], q[v]), max(p[v], q[v])
+                    else:
+                        s1 = s2 = p[v] + (t - p[u]) * (q[v] - p[v]) / (q[u] - p[u])
+                    s_min, s_max = min(s_min, s1), max(s_max, s2)
+            if u:
+                self.line(int(s_min + 0.5), t, int(s_max + 0.5), t, color)
+            else:
+                self.line(t, int(s_min + 0.5), t, int(s_max + 0.5), color)
 
     def draw_floor_grid(self):
         grid_color = 0x222222 # dark grey
         for x in range(MIN_X, MAX_X + 1):
             p1 = self.iso_to_2d(x, MIN_Y, MIN_Z)
             p2 = self.iso_to_2d(x, MAX_Y, MIN_Z)
-            h.line(1, p1[0], p1[1], p2[0], p2[1], grid_color)
+            self.line(p1[0], p1[1], p2[0], p2[1], grid_color)
         for y in range(MIN_Y, MAX_Y + 1):
             p1 = self.iso_to_2d(MIN_X, y, MIN_Z)
             p2 = self.iso_to_2d(MAX_X, y, MIN_Z)
-            h.line(1, p1[0], p1[1], p2[0], p2[1], grid_color)
+            self.line(p1[0], p1[1], p2[0], p2[1], grid_color)
 
     def game_over_animation(self, win):
+        # Every x slice of the filled grid is the same picture shifted on the screen: the first one is drawn
+        # once into the scratch GROB, then blitted once per slice. One slice of cubes and a blit per slice
+        # on every map, paced to last about ANIM_TIME_S. Any key skips the pacing
+        colors = [random.randint(0x333333, 0xFFFFFF) for i in range(ANIM_COLORS)] if win else None
+        corners = [self.iso_to_2d(x, y, z) for x in (MIN_X, MIN_X + 1) for y in (MIN_Y, MAX_Y) for z in (MIN_Z, MAX_Z)]
+        x1, y1, x2, y2 = self.bbox(corners)
+        x1, y1, x2, y2 = max(x1, 0), max(y1, 0), min(x2, SCREEN_W - 1), min(y2, SCREEN_H - 1)
+
+        self.grob, self.clip = SCRATCH_G, None
+        self.fillrect(SCRATCH_G, x1, y1, x2 - x1 + 1, y2 - y1 + 1, SPRITE_KEY, SPRITE_KEY)
+        for z in range(MIN_Z, MAX_Z):
+            for y in range(MIN_Y, MAX_Y):
+                self.draw_cube([MIN_X, y, z], colors[random.randint(0, ANIM_COLORS - 1)] if win else 0xFF0000, False)
+        self.grob = 1
+
+        ref = self.iso_to_2d(MIN_X, MIN_Y, MIN_Z)
+        pause = ANIM_TIME_S / (MAX_X - MIN_X)
         for x in range(MIN_X, MAX_X):
-            for z in range(MIN_Z, MAX_Z):
-                for y in range(MIN_Y, MAX_Y):
-                    if win:
-                        self.draw_cube([x,y,z], random.randint(0x333333, 0xFFFFFF), False)
-                    else:
-                        self.draw_cube([x,y,z], 0xFF0000, False)
-            h.blit(0, 0, 0, 1)
-            if MAP_SIZE < 3:
-                wait(0.001)
+            p = self.iso_to_2d(x, MIN_Y, MIN_Z)
+            self.blit(x1 + p[0] - ref[0], y1 + p[1] - ref[1], SCRATCH_G, x1, y1, x2 + 1, y2 + 1, SPRITE_KEY)
+            if pause:
+                self.copy(0, 1)
+                if int(self.eval("GETKEY")) > 0:
+                    pause = 0
+                else:
+                    wait(pause)
         if win:
-            h.eval('TEXTOUT_P("YOU WIN!!!", G1, 100, 110, 6, 65535, 200, 0')
+            self.eval('TEXTOUT_P("YOU WIN!!!", G1, 100, 110, 6, 65535, 200, 0')
         else:
-            h.eval('TEXTOUT_P("GAME OVER", G1, 100, 110, 6, 65535, 200, 0')
-        if score > get_high_score():
-            save_high_score(score)
-            h.eval('TEXTOUT_P("HIGH SCORE!!!", G1, 90, 160, 6, 0, 200, 16776960)')
-        h.blit(0, 0, 0, 1)
-
-    def draw_shadows(self, coords_xyz, color):
-        global SHADOWS_EN
-        if not SHADOWS_EN:
-            return
-        
+            self.eval('TEXTOUT_P("GAME OVER", G1, 100, 110, 6, 65535, 200, 0')
+        if high_score.submit(score):
+            high_score.flush()
+            self.eval('TEXTOUT_P("HIGH SCORE!!!", G1, 90, 160, 6, 0, 200, 16776960)')
+        self.copy(0, 1)
+
+    def shadow_quads(self, coords_xyz):
+        x, y, z = coords_xyz[0], coords_xyz[1], coords_xyz[2]
+        pr, sy, sz = self.proj, self.stride_y, self.stride_z
+        quads = []
         if SHADOWS_EN >= 1:
             # floor - XY plane at MIN_Z
-            f1 = self.iso_to_2d(coords_xyz[0], coords_xyz[1], MIN_Z)
-            f2 = self.iso_to_2d(coords_xyz[0] + 1, coords_xyz[1], MIN_Z)
-            f3 = self.iso_to_2d(coords_xyz[0] + 1, coords_xyz[1] + 1, MIN_Z)
-            f4 = self.iso_to_2d(coords_xyz[0], coords_xyz[1] + 1, MIN_Z)
-            self.fill_isometric_rect(f1, f2, f3, f4, color)
+            i = self.vertex(x, y, MIN_Z)
+            quads.append((pr[i], pr[i + 1], pr[i + 1 + sy], pr[i + sy]))
         
         if SHADOWS_EN == 2:
             # right wall - YZ plane at MIN_X
-            r1 = self.iso_to_2d(MIN_X, coords_xyz[1], coords_xyz[2])
-            r2 = self.iso_to_2d(MIN_X, coords_xyz[1] + 1, coords_xyz[2])
-            r3 = self.iso_to_2d(MIN_X, coords_xyz[1] + 1, coords_xyz[2] + 1)
-            r4 = self.iso_to_2d(MIN_X, coords_xyz[1], coords_xyz[2] + 1)
-            self.fill_isometric_rect(r1, r2, r3, r4, color)
+            i = self.vertex(MIN_X, y, z)
+            quads.append((pr[i], pr[i + sy], pr[i + sy + sz], pr[i + sz]))
 
             # left wall - XZ plane at MIN_Y
-            l1 = self.iso_to_2d(coords_xyz[0], MIN_Y, coords_xyz[2])
-            l2 = self.iso_to_2d(coords_xyz[0] + 1, MIN_Y, coords_xyz[2])
-            l3 = self.iso_to_2d(coords_xyz[0] + 1, MIN_Y, coords_xyz[2] + 1)
-            l4 = self.iso_to_2d(coords_xyz[0], MIN_Y, coords_xyz[2] + 1)
-            self.fill_isometric_rect(l1, l2, l3, l4, color)
+            i = self.vertex(x, MIN_Y, z)
+            quads.append((pr[i], pr[i + 1], pr[i + 1 + sz], pr[i + sz]))
+        return quads
+
+    def mark_shadows(self, planes, coords_xyz, color):
+        # shadow cells of an entity on the floor, MIN_X wall and MIN_Y wall, packed along their rows
+        x, y, z = coords_xyz[0] - MIN_X, coords_xyz[1] - MIN_Y, coords_xyz[2] - MIN_Z
+        w = MAX_X - MIN_X
+        planes[0][x + y * w] = color
+        if SHADOWS_EN == 2:
+            planes[1][y + z * (MAX_Y - MIN_Y)] = color
+            planes[2][x + z * w] = color
+
+    def shadow_runs(self, game):
+        # the merged shadow quads of the frame, (quad, bbox, color) in drawing order: built once, then
+        # filled in each region recomposed
+        global SHADOWS_EN
+        runs = []
+        if not SHADOWS_EN:
+            return runs
+        
+        # each distinct shadow cell is filled once: the snake shadow covers the prey one, as when drawn after it
+        planes = ({}, {}, {})
+        if game.prey.body:
+            self.mark_shadows(planes, game.prey.body, 0xFF00FF)
+        for idx in game.snake.segments():
+            self.mark_shadows(planes, cell_coords(idx), 0x555555)
+        self.shadow_fills_naive += (game.snake.size + 1) * (3 if SHADOWS_EN == 2 else 1)
+
+        # runs of cells along the fill lines merge into one quad: its lines go through the same points
+        w, hgt = MAX_X - MIN_X, MAX_Y - MIN_Y
+        pr = self.proj
+        layout = ( # row length, run step and side step in the projection table
+            (w, 1, self.stride_y), # floor - XY plane at MIN_Z
+            (hgt, self.stride_y, self.stride_z), # right wall - YZ plane at MIN_X
+            (w, 1, self.stride_z)) # left wall - XZ plane at MIN_Y
+        for color in (0xFF00FF, 0x555555):
+            for p in range(3):
+                cells = planes[p]
+                row, run_step, side = layout[p]
+                keys = sorted(k for k in cells if cells[k] == color)
+                i = 0
+                while i < len(keys):
+                    n = 1
+                    while i + n < len(keys) and keys[i + n] == keys[i] + n and keys[i + n] % row:
+                        n += 1
+                    u, v = keys[i] % row, keys[i] // row
+                    if p == 0:
+                        a = self.vertex(MIN_X + u, MIN_Y + v, MIN_Z)
+                    elif p == 1:
+                        a = self.vertex(MIN_X, MIN_Y + u, MIN_Z + v)
+                    else:
+                        a = self.vertex(MIN_X + u, MIN_Y, MIN_Z + v)
+                    b = a + n * run_step
+                    quad = (pr[a], pr[b], pr[b + side], pr[a + side])
+                    runs.append((quad, self.bbox(quad), color))
+                    i += n
+        return runs
+
+    def draw_shadows(self, runs):
+        c = self.clip
+        for quad, b, color in runs:
+            if c and (b[0] > c[2] or b[2] < c[0] or b[1] > c[3] or b[3] < c[1]):
+                continue
+            self.shadow_fills += 1
+            self.fill_isometric_rect(quad[0], quad[1], quad[2], quad[3], color)
+
+    def cells_in(self, r):
+        # Indices of the cells whose cube may cross the screen region r, back to front. A cube spans the
+        # screen columns of x - y +/- 1 and the rows of x + y - 2z .. x + y - 2z + 2, in tiles: the region
+        # bounds the two diagonals on each level, with a tile of margin. draw_cube() still tests the exact box
+        u_lo = (r[0] - 1 - OFFSET_X) // TILE_W - 1
+        u_hi = (r[2] + 1 - OFFSET_X) // TILE_W + 1
+        w = MAX_X - MIN_X
+        layer = w * (MAX_Y - MIN_Y)
+        for z in range(MIN_Z, MAX_Z):
+            s_lo = (r[1] - 1 - OFFSET_Y) // TILE_H + 2 * z - 3
+            s_hi = (r[3] + 1 - OFFSET_Y) // TILE_H + 2 * z + 3
+            for y in range(MIN_Y, MAX_Y):
+                base = (y - MIN_Y) * w + (z - MIN_Z) * layer - MIN_X
+                for x in range(max(MIN_X, u_lo + y, s_lo - y), min(MAX_X - 1, u_hi + y, s_hi - y) + 1):
+                    yield base + x
+
+    def draw_scene(self, game, shadows):
+        # decorations are in the background layer, already on the target
+        # snake and prey z levels
+        for z, color_hex in self.perimeter_levels(game):
+            self.draw_horizontal_perimeter(z, color_hex, False)
+        if profiler: profiler.mark(PH_PERIMETERS)
+
+        # render shadows
+        self.draw_shadows(shadows)
+        if profiler: profiler.mark(PH_SHADOWS)
+        
+        # render entities - cell indices grow along x, then y, then z: already the (z, y, x) back to front order.
+        # A region only walks the cells in front of it
+        buffer = self.main_buffer
+        for idx in (self.cells_in(self.clip) if self.clip else self.order):
+            entity = buffer.get(idx)
+            if entity is None:
+                continue
+            x, y, z = cell_coords(idx)
+            hidden = self.hidden_edges(idx, x, y, z) if CULLING_EN else 0
+            if hidden == HIDDEN_CUBE:
+                self.culled_faces += 3
+                continue
+            if hidden and not SPRITES_EN: # sprites are blitted whole
+                for bit in (EDGE_TOP_RIGHT, EDGE_TOP_LEFT, EDGE_FRONT):
+                    if hidden & bit:
+                        self.culled_edges += 1
+            self.draw_cube((x, y, z), entity[0], entity[1], hidden)
+        if profiler: profiler.mark(PH_CUBES)
+
+    def draw_hud(self, game):
+        # TEXTOUT(text, GROB*, x, y, font size*, text color*, width*, background color*) 
+        g = "G" + str(self.grob)
+        if game.state == game.State.READY:
+            self.eval('TEXTOUT_P("READY - press any key", ' + g + ', 60, 140, 5, 65535, 200, 0')
+
+        if game.state == game.State.RUN:
+            if (score, self.grob) != self.score_key: # rebuild the HUD commands only when they change
+                self.score_key = (score, self.grob)
+                s_msg = "Score: " + str(score)
+                self.score_cmd = 'TEXTOUT_P("' + s_msg + '", ' + g + ', 10, 10, 3, 65535)'
+            if (high_score.value, self.grob) != self.hiscore_key:
+                self.hiscore_key = (high_score.value, self.grob)
+                s_msg = "High score: " + str(high_score.value)
+                self.hiscore_cmd = 'TEXTOUT_P("' + s_msg + '", ' + g + ', 10, 215, 3, 65535)'
+
+            if self.hits((SCORE_BOX[:2], SCORE_BOX[2:])):
+                self.eval(self.score_cmd)
+
+            if high_score.value > 0 and self.hits((HISCORE_BOX[:2], HISCORE_BOX[2:])):
+                self.eval(self.hiscore_cmd)
+
+    def cell_rects(self, coords_xyz):
+        # screen areas covered by a cube and by its shadows
+        rects = [self.bbox(self.cube_points(coords_xyz[0], coords_xyz[1], coords_xyz[2]))]
+        if SHADOWS_EN:
+            for q in self.shadow_quads(coords_xyz):
+                rects.append(self.bbox(q))
+        return rects
+
+    def dirty_rects(self, game):
+        # screen regions changed since the last frame, None when a full redraw is cheaper
+        if self.full_redraw or self.perimeter_levels(game) != self.prev_perimeters:
+            return None # perimeters span the whole map
+
+        rects = []
+        for idx in self.dirty_cells:
+            rects += self.cell_rects(cell_coords(idx))
+        if score != self.prev_score:
+            rects.append(SCORE_BOX)
+
+        # merge the overlapping regions
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(rects)):
+                for j in range(i + 1, len(rects)):
+                    a, b = rects[i], rects[j]
+                    if a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]:
+                        rects[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                        rects.pop(j)
+                        merged = True
+                        break
+                if merged:
+                    break
+
+        area = 0
+        clipped = []
+        for r in rects:
+            r = (max(r[0], 0), max(r[1], 0), min(r[2], SCREEN_W - 1), min(r[3], SCREEN_H - 1))
+            if r[0] <= r[2] and r[1] <= r[3]:
+                clipped.append(r)
+                area += (r[2] - r[0] + 1) * (r[3] - r[1] + 1)
+        if area * 2 > SCREEN_W * SCREEN_H:
+            return None
+        return clipped
 
     def render(self, game):
 
         if game.state == game.State.GAME_OVER:
+            self.full_redraw = True
+            self.dirty_cells = []
             return
         
         if game.state == game.State.PAUSED:
+            self.full_redraw = True
+            self.dirty_cells = []
             return
         
-        ###### World render START
-        h.fillrect(1, 0, 0, SCREEN_W, SCREEN_H, 0x000000, 0x000000) 
+        self.line_count = 0
+        self.blit_count = 0
+        self.fill_count = 0
+        self.eval_count = 0
+        self.culled_faces = 0
+        self.culled_edges = 0
+        self.shadow_fills = 0
+        self.shadow_fills_naive = 0
+        if profiler: profiler.begin()
+        rects = self.dirty_rects(game) if DIRTY_RENDER and game.state == game.State.RUN else None
+        if profiler: profiler.mark(PH_RECTS)
+        shadows = self.shadow_runs(game)
+        if profiler: profiler.mark(PH_SHADOWS)
 
-        # decorations
-        self.draw_floor_grid()
-        self.draw_grid_cube()
-
-        # snake and prey z levels
-        if PERIMETERS > 0 and GAME_DIMENSIONS > 2:
-            if game.snake.head()[2] == game.prey.body[2]:
-                self.draw_horizontal_perimeter(game.snake.head()[2], 0x0000FF, False)
-            else:
-                if PERIMETERS == 2:
-                    self.draw_horizontal_perimeter(game.snake.head()[2], 0x00FF00, False)
-                self.draw_horizontal_perimeter(game.prey.body[2], 0xFF00FF, False)
-
-        # render shadows
-        self.draw_shadows(game.prey.body, 0xFF00FF)
-        for snake_block in game.snake.body:
-            self.draw_shadows(snake_block, 0x555555)
-        
-        # render entities
-        items = list(self.main_buffer.items())
-        items.sort(key=lambda item: (item[0][2], item[0][1], item[0][0]))
-        for coords_xyz, entity in items:
-            self.draw_cube(coords_xyz, entity[0], entity[1])
+        ###### World render START
+        if rects is None:
+            self.draw_background(1)
+            if profiler: profiler.mark(PH_BACKGROUND)
+            self.draw_scene(game, shadows)
+            self.draw_hud(game)
+            if profiler: profiler.mark(PH_HUD)
+        else:
+            # recompose each dirty region offscreen, then copy just that region over G1
+            self.grob = SCRATCH_G
+            for r in rects:
+                self.clip = r
+                self.copy(SCRATCH_G, BACKGROUND_G, r)
+                if profiler: profiler.mark(PH_BACKGROUND)
+                self.draw_scene(game, shadows)
+                self.draw_hud(game)
+                if profiler: profiler.mark(PH_HUD)
+                self.copy(1, SCRATCH_G, r)
+                if profiler: profiler.mark(PH_PRESENT)
+            self.grob = 1
+            self.clip = None
         ###### World render END
 
-        # UI overlay
-        # TEXTOUT(text, GROB*, x, y, font size*, text color*, width*, background color*) 
-        if game.state == game.State.READY:
-            h.eval('TEXTOUT_P("READY - press any key", G1, 60, 140, 5, 65535, 200, 0')
-
-        if game.state == game.State.RUN:
-            global score
-            s_msg = "Score: " + str(score)
-            h.eval('TEXTOUT_P("' + s_msg + '", G1, 10, 10, 3, 65535)')
-
-            hiscore = get_high_score()
-            if get_high_score() > 0:
-                s_msg = "High score: " + str(hiscore)
-                h.eval('TEXTOUT_P("' + s_msg + '", G1, 10, 215, 3, 65535)')
+        self.full_redraw = game.state != game.State.RUN
+        self.dirty_cells = []
+        self.prev_perimeters = self.perimeter_levels(game)
+        self.prev_score = score
 
-        # h.blit(target, dx, dy, source)
-        h.blit(0, 0, 0, 1) 
+        self.copy(0, 1)
+        if profiler: profiler.mark(PH_PRESENT)
 
 class Config:
+    # Settings profile, saved in a single calculator variable as the digits of one number:
+    # game dimensions, shadows of the 3D mode, map size, game speed, quick start
+    VAR_NAME = "SNAKE3D_CFG"
+
     def __init__(self):
-        pass
+        self.capture()
+
+    def capture(self):
+        # take the current settings
+        self.quick_start = QUICK_START
+        self.dimensions = GAME_DIMENSIONS
+        self.shadows = SHADOWS_3D
+        self.map_size = MAP_SIZE
+        self.speed = GAME_SPEED
+
+    def load(self):
+        try:
+            res = h.eval(Config.VAR_NAME)
+            if res == None:
+                return False
+            code = int(res)
+        except:
+            return False
+        digits = [int(c) for c in str(code)]
+        if len(digits) != 5:
+            return False
+        dimensions, shadows, map_size, speed, quick_start = digits
+        if dimensions not in (2, 3) or shadows > 2 or not 1 <= map_size <= 3 or not 1 <= speed <= 3 or quick_start > 1:
+            return False
+        self.dimensions, self.shadows, self.map_size, self.speed, self.quick_start = digits
+        return True
+
+    def save(self):
+        code = "{}{}{}{}{}".format(self.dimensions, self.shadows, self.map_size, self.speed, self.quick_start)
+        h.eval(Config.VAR_NAME + ":=" + code)
+
+    def apply(self):
+        global QUICK_START, GAME_DIMENSIONS, SHADOWS_3D, MAP_SIZE, GAME_SPEED
+        QUICK_START = self.quick_start
+        GAME_DIMENSIONS = self.dimensions
+        SHADOWS_3D = self.shadows
+        MAP_SIZE = self.map_size
+        GAME_SPEED = self.speed
+        apply_settings()
 
 class Game: 
     class State:
@@ -429,9 +1255,54 @@ class Game:
         self.world = world
         self.snake = snake
         self.prey = prey
+        self.keys = [0] * INPUT_QUEUE_LEN # ring of the pressed keys waiting for a tick
+        self.key_times = [0] * INPUT_QUEUE_LEN # millis of each press
+        self.key_first = 0
+        self.key_count = 0
+        self.queued_velocity = [1, 0, 0] # snake velocity once all the queued turns are applied
+        self.key_latency_ms = 0 # time from the press to the tick of the last consumed key
+        self.consumed_key = -1 # key consumed by the last update, for the replays
+        self.replay_key = None # when playing a replay: the key of the next update, in place of the input
+
+    def poll_input(self):
+        # called from the fast loop between ticks, so quick sequences are not lost
+        key = int(self.world.eval("GETKEY"))
+        if key > 0:
+            self.queue_key(key)
+
+    def queue_key(self, key):
+        if self.key_count == INPUT_QUEUE_LEN:
+            return # full, drop the newest press
+
+        if self.state == self.State.RUN and key != self.KEY_ENTER:
+            base = self.queued_velocity if self.key_count else self.snake.velocity
+            velocity = list(base)
+            self.update_direction(key, velocity)
+            if velocity == base:
+                return # no effect: not a direction key, or up/down in 2D
+            self.queued_velocity = velocity
+
+        i = (self.key_first + self.key_count) % INPUT_QUEUE_LEN
+        self.keys[i] = key
+        self.key_times[i] = millis
+        self.key_count += 1
+
+    def clear_keys(self):
+        self.key_count = 0
 
     def get_key(self):
-        return int(h.eval("GETKEY"))
+        if self.replay_key is not None:
+            self.consumed_key = self.replay_key
+            return self.replay_key
+        self.poll_input()
+        if not self.key_count:
+            return -1
+        key = self.keys[self.key_first]
+        self.key_latency_ms = millis - self.key_times[self.key_first]
+        self.key_first = (self.key_first + 1) % INPUT_QUEUE_LEN
+        self.key_count -= 1
+        self.consumed_key = key
+        return key
     
     KEY_UP = 2
     KEY_DOWN = 12
@@ -476,10 +1347,11 @@ class Game:
 
     def update(self):
         global score
+        self.consumed_key = -1
 
         if self.state == self.State.RESET: 
-            h.fillrect(1, 0, 0, SCREEN_W, SCREEN_H, 0x000000, 0x000000) 
-            h.blit(0, 0, 0, 1) # h.blit(target, dx, dy, source)
+            self.world.draw_background(1)
+            self.world.copy(0, 1)
             self.state = self.State.INIT
             return
 
@@ -514,29 +1386,37 @@ class Game:
             return
         
         if self.state == self.State.RUN:
+            if profiler: profiler.begin()
             key = self.get_key()
+            if profiler: profiler.mark(PH_INPUT)
             if key == self.KEY_ENTER:
-                h.eval('TEXTOUT_P("PAUSED - press ENTER", G1, 60, 140, 5, 65535, 200, 0)')
-                h.blit(0, 0, 0, 1) 
+                self.world.eval('TEXTOUT_P("PAUSED - press ENTER", G1, 60, 140, 5, 65535, 200, 0)')
+                self.world.copy(0, 1)
                 self.state = self.State.PAUSED
                 return
             self.update_direction(key, self.snake.velocity)
             self.snake.move()
+            if profiler: profiler.mark(PH_MOVE)
 
             if self.snake.head() == self.prey.body:
                 score += 1
                 self.snake.grow()
                 self.prey.spawn(self.snake)
+                if profiler: profiler.mark(PH_SPAWN)
                 if self.prey.body == []:
                     self.world.game_over_animation(True)
                     self.state = self.State.GAME_OVER 
+                    self.clear_keys()
+                    if profiler: profiler.mark(PH_ANIM)
             
-            for snake_block in self.snake.body[:-1]:
-                if self.snake.head() == snake_block: # game over
-                    self.world.game_over_animation(False)
-                    self.state = self.State.GAME_OVER 
-
-            self.world.load_buffer(self.snake, self.prey)
+            if self.snake.collided(): # game over
+                self.world.game_over_animation(False)
+                self.state = self.State.GAME_OVER 
+                self.clear_keys()
+                if profiler: profiler.mark(PH_ANIM)
+
+            self.world.update_buffer(self.snake, self.prey)
+            if profiler: profiler.mark(PH_BUFFER)
             return
 
         self.state = self.State.RESET
@@ -549,20 +1429,58 @@ class Snake3D:
         self.separator = int(h.eval('HSeparator')) # Save the current separator state and set it to 0
         h.eval('HSeparator := 0')
 
-        show_settings_menu() # prompt user game settings
-        if get_high_score() < 0: save_high_score(0) # init hiscore var if needed
+        self.recorder = None
+        config = Config()
+        if config.load():
+            config.apply() # last used settings, also the menu defaults
+        if not (QUICK_START and int(h.eval("GETKEY")) < 0): # a key held at launch brings the menu back
+            show_settings_menu() # prompt user game settings
+            config.capture()
+            config.save()
+        global high_score, random
+        high_score = HighScore() # read the hiscore var once, init it if needed
+        if REPLAY_EN:
+            seed = ticks_ms() & 0xFFFFFFFF
+            random = XorShift(seed)
+            self.recorder = Replay(seed, (GAME_DIMENSIONS, SHADOWS_EN, MAP_SIZE, GAME_SPEED, PERIMETERS))
 
         h.dimgrob(1, SCREEN_W, SCREEN_H, 0x0000) # init G1
+        h.dimgrob(SCRATCH_G, SCREEN_W, SCREEN_H, 0x0000) # init the dirty regions scratch
 
         # init game objects
         self.world = World() 
         self.snake = Snake()
         self.prey = Prey()
         self.game = Game(self.world, self.snake, self.prey)
+        global profiler
+        if PROFILE_EN:
+            profiler = Profiler(self.world)
+
+        # stats of the last tick, ms
+        self.logic_ms = 0
+        self.render_ms = 0
+        self.slack_ms = 0 # time left before the next tick, negative when late
+        self.skipped_frames = 0 # renders skipped since the launch to keep the logic rate
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        h.eval('HSeparator := ' + repr(self.separator)) # reset separator
+        try:
+            if high_score:
+                high_score.submit(score) # keep a record made in a game left before its end
+                high_score.flush()
+            if self.recorder:
+                self.recorder.score = score
+                self.recorder.state = self.game.state
+                try:
+                    self.recorder.save(REPLAY_FILE)
+                except OSError: # no file support or no room left: the session is just not recorded
+                    pass
+            if profiler:
+                # the times of the last ticks, the renders skipped since the launch and the wait of the last key
+                report = "{};skipped:{};latency:{}".format(profiler.report(), self.skipped_frames, self.game.key_latency_ms)
+                h.eval(Profiler.VAR_NAME + ':="' + report + '"') # for a look after the game
+        finally:
+            h.eval('HSeparator := ' + repr(self.separator)) # reset separator
         return exc_type is KeyboardInterrupt
 
     def run(self):
@@ -570,15 +1488,42 @@ class Snake3D:
             global millis
             h.eval('RECT()')
             
+            step = BASE_REFRESH_T_MS / GAME_SPEED # fixed logic timestep
+            next_tick = ticks_ms()
+            skipped = 0
             while True:
-                wait(0.010)
-                millis += 10
-                if millis >= BASE_REFRESH_T_MS / GAME_SPEED:
-                    millis = 0
-                    self.game.update()
+                millis = ticks_ms()
+                if millis < next_tick:
+                    self.game.poll_input()
+                    wait(min(next_tick - millis, 10) / 1000)
+                    continue
+                if millis - next_tick > MAX_CATCH_UP * step:
+                    next_tick = millis # long stall (game over animation) - don't rush the next ticks
+
+                self.game.update()
+                if self.recorder:
+                    self.recorder.add(self.game.consumed_key)
+                t = ticks_ms()
+                self.logic_ms = t - millis
+                next_tick += step
+
+                if t > next_tick and skipped < MAX_FRAME_SKIP:
+                    # late for the next tick: skip this render rather than slow down the game
+                    skipped += 1
+                    self.skipped_frames += 1
+                    self.render_ms = 0
+                else:
+                    skipped = 0
                     self.game.draw()
+                    self.render_ms = ticks_ms() - t
+                    if PROFILE_EN > 1 and profiler:
+                        profiler.draw()
+                self.slack_ms = next_tick - ticks_ms()
+                if profiler:
+                    profiler.commit(self.logic_ms, self.render_ms, int(self.slack_ms))
                     
-Snake3D().run()
+if h is not None: # off the calculator the module only defines the game, see tools/headless.py
+    Snake3D().run()
 #END
 
 EXPORT SNAKE_3D()
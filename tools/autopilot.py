@@ -0,0 +1,239 @@
+#-----------------------------------------------------------------------
+# Snake3D - autopilot
+# Copyright (C) 2026 ArcticDogsInc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+#-----------------------------------------------------------------------
+
+# A bot playing the game through its keys, for soak runs up to a full grid:
+#
+#   python tools/autopilot.py --dimensions 3 --map-size 2 --seed 7
+#
+# The snake goes around a closed path through every cell of the grid: the body stays behind the
+# head along the path and follows its own tail, up to a full grid. Whenever a neighbour cell closer
+# to the prey (breadth-first distances over the free cells, with the grid wrapping around) is
+# further along the path, the snake may take that shortcut. The cells it skips are only filled
+# again when the tail gets past them, while each meal brings the tail one cell closer: a shortcut
+# has to leave room ahead for the growth to come, and past half the grid the snake keeps to the
+# path.
+
+import argparse
+import time
+
+from backend import Backend, NumpyBackend
+from headless import load_engine, configure, new_game, tick
+
+SAFETY = 3 # path cells kept free between the head and the tail by a shortcut, on top of the growth
+CROWDED = 10 # path cells given up when the next prey may well spawn between the head and the tail
+
+def cycle(w, h):
+    # Closed walk through every (i, j) of a w x h grid, w even: along j = 0, then back and forth
+    # along j over the columns w - 1 to 1, back to the start along column 0
+    cells = [(i, 0) for i in range(w)]
+    for n, i in enumerate(range(w - 1, 0, -1)):
+        js = range(1, h) if n % 2 == 0 else range(h - 1, 0, -1)
+        cells += [(i, j) for j in js]
+    return cells + [(0, j) for j in range(h - 1, 0, -1)]
+
+def grid_path(engine):
+    # every cell once, each one next to the previous and the last next to the first: a closed walk
+    # through a layer, itself walked through over the layers like a grid
+    layer = cycle(engine.MAX_X - engine.MIN_X, engine.MAX_Y - engine.MIN_Y)
+    layers = engine.MAX_Z - engine.MIN_Z
+    order = cycle(len(layer), layers) if layers > 1 else [(i, 0) for i in range(len(layer))]
+    return [(engine.MIN_X + layer[i][0], engine.MIN_Y + layer[i][1], engine.MIN_Z + k) for i, k in order]
+
+def step(a, b):
+    return [b[0] - a[0], b[1] - a[1], b[2] - a[2]]
+
+def key_for(game, velocity, target):
+    # the key turning the snake from velocity to target, -1 to go on
+    if velocity == target:
+        return -1
+    for key in (game.KEY_LEFT, game.KEY_RIGHT, game.KEY_UP, game.KEY_DOWN):
+        v = list(velocity)
+        game.update_direction(key, v)
+        if v == target:
+            return key
+    raise ValueError("no key turns {} into {}".format(velocity, target))
+
+DIRECTIONS = ([1, 0, 0], [-1, 0, 0], [0, 1, 0], [0, -1, 0], [0, 0, 1], [0, 0, -1])
+
+class Autopilot():
+    def __init__(self, engine, game):
+        self.engine = engine
+        self.game = game
+        e = engine
+        path = [e.cell_index(p) for p in grid_path(e)]
+        self.n = n = len(path)
+
+        # go around the path the way the starting snake faces
+        snake = game.snake
+        tail, head = snake.tail_cell(), snake.head_cell()
+        if (path.index(head) - path.index(tail)) % n > n // 2:
+            path.reverse()
+        self.position = [0] * n # place of each cell along the path
+        self.successor = [0] * n
+        for i in range(n):
+            self.position[path[i]] = i
+            self.successor[path[i]] = path[(i + 1) % n]
+
+        # neighbours of each cell, the grid wrapping around, as (cell, direction) pairs
+        self.neighbours = [None] * n
+        directions = DIRECTIONS if e.MAX_Z - e.MIN_Z > 1 else DIRECTIONS[:4]
+        for c in range(n):
+            x, y, z = e.cell_coords(c)
+            pairs = []
+            for d in directions:
+                p = (e.MIN_X + (x + d[0] - e.MIN_X) % (e.MAX_X - e.MIN_X),
+                     e.MIN_Y + (y + d[1] - e.MIN_Y) % (e.MAX_Y - e.MIN_Y),
+                     e.MIN_Z + (z + d[2] - e.MIN_Z) % (e.MAX_Z - e.MIN_Z))
+                pairs.append((e.cell_index(p), d))
+            self.neighbours[c] = tuple(pairs)
+
+        # breadth-first search buffers, allocated once: a cell's distance is valid when its stamp
+        # is the one of the last search, so nothing is cleared between searches
+        self.distance = [0] * n
+        self.stamps = [0] * n
+        self.queue = [0] * n
+        self.stamp = 0
+        self.target = -1 # prey cell of the distances, -1 to search again
+        self.searches = 0
+
+    def search(self, target):
+        # distances to target over the free cells
+        self.stamp += 1
+        self.searches += 1
+        self.target = target
+        stamp, distance, stamps, queue, cells = self.stamp, self.distance, self.stamps, self.queue, self.game.snake.cells
+        distance[target] = 0
+        stamps[target] = stamp
+        queue[0] = target
+        head, end = 0, 1
+        while head < end:
+            c = queue[head]
+            head += 1
+            d = distance[c] + 1
+            for nb, direction in self.neighbours[c]:
+                if stamps[nb] != stamp and not cells[nb]:
+                    stamps[nb] = stamp
+                    distance[nb] = d
+                    queue[end] = nb
+                    end += 1
+
+    def next_cell(self):
+        # successor of the head along the path, or a shortcut towards the prey
+        game, n = self.game, self.n
+        snake = game.snake
+        head = snake.head_cell()
+        prey = self.engine.cell_index(game.prey.body)
+        if prey != self.target:
+            self.search(prey)
+
+        tail = snake.tail_cell()
+        base = self.position[head]
+        to_tail = (self.position[tail] - base) % n or n
+        to_prey = (self.position[prey] - base) % n
+        best = self.successor[head]
+        best_distance = self.distance[best] if self.stamps[best] == self.stamp else n
+
+        # how far along the path a shortcut may land: the gap to the tail, less the growth still to
+        # come - the copies of the tail left by grow(), the prey on the way and maybe the next one
+        free = snake.free.count
+        reach = to_tail - (snake.cells[tail] - 1) - SAFETY
+        if free * 2 < n:
+            reach = 0 # past half the grid: the path only
+        elif to_prey < to_tail:
+            reach -= 1
+            if (to_tail - to_prey) * 4 > free:
+                reach -= CROWDED
+        for nb, direction in self.neighbours[head]:
+            if snake.cells[nb] or self.stamps[nb] != self.stamp:
+                continue
+            ahead = (self.position[nb] - base) % n
+            if ahead > to_prey or ahead > reach:
+                continue # would pass the prey, or eat into the room kept for the growth
+            if self.distance[nb] < best_distance:
+                best, best_distance = nb, self.distance[nb]
+        if best_distance == n:
+            self.target = -1 # the body has cut every way known: search again at the next tick
+
+        if best == tail and snake.cells[tail] > 1:
+            # the tail stays one more tick after a meal: any free cell rather than into it
+            for nb, direction in self.neighbours[head]:
+                if not snake.cells[nb]:
+                    return nb
+        return best
+
+    def next_key(self):
+        game = self.game
+        if game.state == game.State.READY:
+            return game.KEY_UP # any key starts
+        if game.state != game.State.RUN:
+            return -1
+        cell = self.next_cell()
+        for nb, direction in self.neighbours[game.snake.head_cell()]:
+            if nb == cell:
+                return key_for(game, game.snake.velocity, list(direction))
+
+def play(dimensions, map_size, seed, max_ticks, draw=False, pixels=False):
+    # one game driven by the autopilot until it is won or lost
+    engine = load_engine()
+    configure(engine, dimensions, 1, map_size)
+    backend = NumpyBackend(seed) if pixels else Backend(seed)
+    game = new_game(engine, backend)
+    ticks = 0
+    pilot = None
+    worst_ms = 0
+    think_ms = 0
+    start = time.perf_counter()
+    while ticks < max_ticks:
+        if game.state == game.State.READY and pilot is None:
+            pilot = Autopilot(engine, game)
+        t = time.perf_counter()
+        key = pilot.next_key() if pilot else -1
+        ms = (time.perf_counter() - t) * 1000
+        think_ms += ms
+        worst_ms = max(worst_ms, ms)
+        tick(engine, game, backend, key, draw)
+        ticks += 1
+        if game.state == game.State.GAME_OVER:
+            break
+    return {
+        "result": "win" if game.prey.body == [] else ("lost" if game.state == game.State.GAME_OVER else "timeout"),
+        "ticks": ticks,
+        "score": engine.score,
+        "length": game.snake.size,
+        "cells": engine.cell_count(),
+        "searches": pilot.searches if pilot else 0,
+        "think_ms_mean": think_ms / max(ticks, 1),
+        "think_ms_max": worst_ms,
+        "seconds": time.perf_counter() - start,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Let the autopilot play Snake3D headless")
+    parser.add_argument("--dimensions", type=int, default=3, choices=(2, 3))
+    parser.add_argument("--map-size", type=int, default=1, choices=(1, 2, 3))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-ticks", type=int, default=10000000)
+    parser.add_argument("--draw", action="store_true", help="render every tick as well")
+    parser.add_argument("--pixels", action="store_true", help="render into NumPy framebuffers")
+    args = parser.parse_args()
+    r = play(args.dimensions, args.map_size, args.seed, args.max_ticks, args.draw or args.pixels, args.pixels)
+    print("{result}: {ticks} ticks, score {score}, length {length} of {cells} cells, {searches} searches, "
+          "{think_ms_mean:.3f} ms per decision (max {think_ms_max:.2f}), {seconds:.1f} s".format(**r))
+
+if __name__ == "__main__":
+    main()
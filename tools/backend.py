@@ -0,0 +1,185 @@
+#-----------------------------------------------------------------------
+# Snake3D - desktop backends for the game engine
+# Copyright (C) 2026 ArcticDogsInc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+#-----------------------------------------------------------------------
+
+# Stand-ins for the hpprime and urandom calls of src/snake.py, plugged with use_backend().
+# Backend only keeps the calculator state the game reads back (keys, clock, variables) and counts
+# the calls, NumpyBackend also draws them in NumPy framebuffers.
+
+import hashlib
+import random
+import re
+import time
+
+SCREEN_W = 320
+SCREEN_H = 240
+
+class Random():
+    # urandom replacement, seeded so that a game can be played again
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+
+    def seed(self, seed):
+        self.rng.seed(seed)
+
+    def randint(self, a, b):
+        return self.rng.randint(a, b)
+
+class Backend():
+    # No drawing: the fastest way to run the game logic and the renderer's own work
+    ASSIGN = re.compile(r"^(\w+)\s*:=\s*(.*)$")
+
+    def __init__(self, seed=0, realtime=False):
+        self.random = Random(seed)
+        self.realtime = realtime # TICKS and WAIT follow the wall clock, else a virtual one moved by WAIT
+        self.clock_ms = 0
+        self.start = time.perf_counter()
+        self.keys = [] # pending key presses, read by GETKEY
+        self.vars = {"HSeparator": 0} # calculator variables
+        self.texts = [] # TEXTOUT_P commands, the texts are not drawn
+        self.calls = {"line": 0, "fillrect": 0, "blit": 0, "dimgrob": 0, "eval": 0}
+
+    def press(self, key):
+        self.keys.append(key)
+
+    def ticks(self):
+        if self.realtime:
+            return int((time.perf_counter() - self.start) * 1000)
+        return self.clock_ms
+
+    def line(self, g, x1, y1, x2, y2, c):
+        self.calls["line"] += 1
+
+    def fillrect(self, g, x, y, w, h, edge, fill):
+        self.calls["fillrect"] += 1
+
+    def blit(self, dst, dx, dy, src, sx1=None, sy1=None, sx2=None, sy2=None, c=None):
+        self.calls["blit"] += 1
+
+    def dimgrob(self, g, w, h, c):
+        self.calls["dimgrob"] += 1
+
+    def eval(self, cmd):
+        self.calls["eval"] += 1
+        cmd = cmd.strip()
+        if cmd == "GETKEY":
+            return self.keys.pop(0) if self.keys else -1
+        if cmd == "TICKS":
+            return self.ticks()
+        if cmd.startswith("WAIT("):
+            t_s = float(cmd[5:-1])
+            if self.realtime:
+                time.sleep(t_s)
+            else:
+                self.clock_ms += int(t_s * 1000)
+            return 0
+        if cmd.startswith("TEXTOUT_P("):
+            self.texts.append(cmd)
+            return 0
+        if cmd.startswith("CHOOSE("):
+            return 0 # cancelled: the settings stay as they are
+        if cmd == "RECT()":
+            self.fillrect(0, 0, 0, SCREEN_W, SCREEN_H, 0xFFFFFF, 0xFFFFFF)
+            return 0
+        m = Backend.ASSIGN.match(cmd)
+        if m:
+            value = m.group(2)
+            self.vars[m.group(1)] = value[1:-1] if value.startswith('"') else int(value)
+            return 0
+        return self.vars.get(cmd) # None for an undefined variable
+
+class NumpyBackend(Backend):
+    # GROBs as 2D arrays of 0xRRGGBB colors, drawn with whole-array operations
+    def __init__(self, seed=0, realtime=False):
+        import numpy
+        self.np = numpy
+        Backend.__init__(self, seed, realtime)
+        self.grobs = {}
+        for g in range(10):
+            self.grobs[g] = numpy.zeros((SCREEN_H, SCREEN_W), numpy.uint32)
+
+    def line(self, g, x1, y1, x2, y2, c):
+        # Bresenham's pixels in closed form: step i on the major axis moves the minor one by
+        # i * minor / major rounded half up
+        self.calls["line"] += 1
+        np = self.np
+        x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+        adx, ady = abs(x2 - x1), abs(y2 - y1)
+        sx, sy = (1 if x2 > x1 else -1), (1 if y2 > y1 else -1)
+        n = max(adx, ady)
+        i = np.arange(n + 1)
+        if n == 0:
+            xs, ys = i + x1, i + y1
+        elif adx >= ady:
+            xs, ys = x1 + sx * i, y1 + sy * ((2 * i * ady + n) // (2 * n))
+        else:
+            xs, ys = x1 + sx * ((2 * i * adx + n) // (2 * n)), y1 + sy * i
+        grob = self.grobs[g]
+        inside = (xs >= 0) & (xs < grob.shape[1]) & (ys >= 0) & (ys < grob.shape[0])
+        grob[ys[inside], xs[inside]] = c
+
+    def fillrect(self, g, x, y, w, h, edge, fill):
+        self.calls["fillrect"] += 1
+        grob = self.grobs[g]
+        x, y, w, h = int(x), int(y), int(w), int(h)
+        if w <= 0 or h <= 0:
+            return
+        grob[max(y, 0):max(y + h, 0), max(x, 0):max(x + w, 0)] = edge
+        grob[max(y + 1, 0):max(y + h - 1, 0), max(x + 1, 0):max(x + w - 1, 0)] = fill
+
+    def blit(self, dst, dx, dy, src, sx1=None, sy1=None, sx2=None, sy2=None, c=None):
+        # sx2, sy2 exclusive, c the transparent color
+        self.calls["blit"] += 1
+        s, d = self.grobs[src], self.grobs[dst]
+        if sx1 is None:
+            sx1, sy1, sx2, sy2 = 0, 0, s.shape[1], s.shape[0]
+        dx, dy = int(dx), int(dy)
+        sx1, sy1, sx2, sy2 = int(sx1), int(sy1), int(sx2), int(sy2)
+        # clip the source to its GROB, then the destination to its own
+        lx, ly = max(-sx1, -dx, 0), max(-sy1, -dy, 0)
+        hx = min(sx2, s.shape[1]) - sx1
+        hx = min(hx, d.shape[1] - dx)
+        hy = min(sy2, s.shape[0]) - sy1
+        hy = min(hy, d.shape[0] - dy)
+        if hx <= lx or hy <= ly:
+            return
+        region = s[sy1 + ly:sy1 + hy, sx1 + lx:sx1 + hx].copy()
+        target = d[dy + ly:dy + hy, dx + lx:dx + hx]
+        if c is None:
+            target[:] = region
+        else:
+            keep = region != c
+            target[keep] = region[keep]
+
+    def dimgrob(self, g, w, h, c):
+        self.calls["dimgrob"] += 1
+        self.grobs[g] = self.np.full((int(h), int(w)), c, self.np.uint32)
+
+    def frame(self, g=0):
+        return self.grobs[g].copy()
+
+    def digest(self, g=0):
+        # compare frames pixel for pixel across runs
+        return hashlib.sha1(self.grobs[g].tobytes()).hexdigest()
+
+    def save_ppm(self, path, g=0):
+        np = self.np
+        grob = self.grobs[g]
+        rgb = np.stack(((grob >> 16) & 0xFF, (grob >> 8) & 0xFF, grob & 0xFF), axis=-1).astype(np.uint8)
+        with open(path, "wb") as f:
+            f.write("P6 {} {} 255\n".format(grob.shape[1], grob.shape[0]).encode())
+            f.write(rgb.tobytes())
@@ -0,0 +1,175 @@
+#-----------------------------------------------------------------------
+# Snake3D - benchmark suite
+# Copyright (C) 2026 ArcticDogsInc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+#-----------------------------------------------------------------------
+
+# Cost of a tick (Game.update and World.render) over every map, mode, shadows and perimeters
+# setting, with the snake 2 cells long up to filling the grid:
+#
+#   python tools/bench.py                 # compare with bench_baseline.json
+#   python tools/bench.py --save          # store the results as the new baseline
+#
+# The calls are counted by the recording Backend, nothing is drawn, so the wall time is the
+# engine's own. The snake follows a scripted closed path through every cell of the grid, steered
+# with the game keys, and the prey spawns are seeded: each run is the same.
+# A run regresses when its calls per tick exceed the baseline by more than --threshold, or
+# its time by more than --time-threshold when --check-time is given.
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from autopilot import grid_path, step, key_for
+from backend import Backend
+from headless import load_engine, configure, new_game, tick
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+TICKS = 30 # measured ticks per run, after one warm-up tick
+LENGTHS = ("2", "1/4", "1/2", "full") # snake lengths, in cells or parts of the grid
+CALLS = ("line", "fillrect", "blit", "eval")
+
+def settings_matrix():
+    for dimensions in (2, 3):
+        for map_size in (1, 2, 3):
+            for shadows in ((0, 1, 2) if dimensions > 2 else (0,)):
+                for perimeters in (0, 1, 2):
+                    yield dimensions, map_size, shadows, perimeters
+
+def place_snake(engine, game, cells):
+    # a running game with the snake over cells, from tail to head
+    snake = game.snake
+    for idx in list(snake.segments()):
+        snake.release(idx)
+    snake.start, snake.size = 0, len(cells)
+    for i in range(len(cells)):
+        snake.ring[i] = engine.cell_index(cells[i])
+        snake.occupy(snake.ring[i])
+    snake.pos = list(cells[-1])
+    snake.velocity = step(cells[-2], cells[-1])
+    game.prey.spawn(snake)
+    game.world.load_buffer(snake, game.prey)
+    game.state = game.State.RUN
+    engine.score = len(cells) - 2
+
+def run(settings, label, ticks, trace=False):
+    dimensions, map_size, shadows, perimeters = settings
+    backend = Backend(seed=1)
+    engine = load_engine()
+    configure(engine, dimensions, shadows, map_size, 2, perimeters)
+    game = new_game(engine, backend)
+    path = grid_path(engine)
+    length = {"2": 2, "1/4": len(path) // 4, "1/2": len(path) // 2,
+              "full": max(len(path) - ticks - 2, len(path) * 3 // 4)}[label] # full leaves room for the prey
+    place_snake(engine, game, path[:length])
+
+    counts = [0, 0, 0] # faces culled, shadow fills made and without the merging
+    def play(head, n):
+        world = game.world
+        for i in range(n):
+            a, b = path[(head + i) % len(path)], path[(head + i + 1) % len(path)]
+            key = key_for(game, game.snake.velocity, step(a, b))
+            tick(engine, game, backend, key)
+            counts[0] += world.culled_faces
+            counts[1] += world.shadow_fills
+            counts[2] += world.shadow_fills_naive
+        return head + n
+
+    head = play(length - 1, 1) # warm up: first full redraw, sprites
+    if trace:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        peak = 0
+        for i in range(ticks):
+            tracemalloc.reset_peak()
+            head = play(head, 1)
+            peak += tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+        return {"alloc_kb": round(peak / ticks / 1024, 2)}
+
+    calls = dict(backend.calls)
+    counts[:] = [0, 0, 0]
+    t = time.perf_counter()
+    head = play(head, ticks)
+    result = {"ms": round((time.perf_counter() - t) * 1000 / ticks, 3), "length": game.snake.size}
+    for name in CALLS:
+        result[name] = round((backend.calls[name] - calls[name]) / ticks, 1)
+    result["culled"], result["shadows"], result["naive"] = [round(c / ticks, 1) for c in counts]
+    return result
+
+def run_name(settings, label):
+    dimensions, map_size, shadows, perimeters = settings
+    return "{}D map {} shadows {} perimeters {} length {}".format(dimensions, "SNL"[map_size - 1], shadows, perimeters, label)
+
+def main():
+    parser = argparse.ArgumentParser(description="Snake3D tick cost across the settings")
+    parser.add_argument("--ticks", type=int, default=TICKS)
+    parser.add_argument("--filter", default="", help="only the runs whose name contains this text")
+    parser.add_argument("--no-alloc", action="store_true", help="skip the allocation pass, much faster")
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed increase of the calls per tick")
+    parser.add_argument("--check-time", action="store_true", help="also compare the time per tick")
+    parser.add_argument("--time-threshold", type=float, default=0.50)
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    print("{:<48} {:>8} {:>6} {:>8} {:>8} {:>6} {:>6} {:>7} {:>11} {:>9}".format(
+        "run", "ms/tick", "len", "line", "fillrect", "blit", "eval", "culled", "shadows", "alloc KB"))
+    for settings in settings_matrix():
+        for label in LENGTHS:
+            name = run_name(settings, label)
+            if args.filter not in name:
+                continue
+            result = run(settings, label, args.ticks)
+            if not args.no_alloc:
+                result.update(run(settings, label, args.ticks, trace=True))
+            results[name] = result
+            print("{:<48} {:>8.3f} {:>6} {:>8} {:>8} {:>6} {:>6} {:>7} {:>11} {:>9}".format(
+                name, result["ms"], result["length"], result["line"], result["fillrect"], result["blit"],
+                result["eval"], result["culled"], "{}/{}".format(result["shadows"], result["naive"]),
+                result.get("alloc_kb", "-")))
+
+            old = baseline.get(name)
+            if old:
+                for key in CALLS:
+                    if result[key] > old[key] * (1 + args.threshold) + 0.5:
+                        regressions.append("{}: {} {} -> {}".format(name, key, old[key], result[key]))
+                if args.check_time and result["ms"] > old["ms"] * (1 + args.time_threshold):
+                    regressions.append("{}: ms {} -> {}".format(name, old["ms"], result["ms"]))
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print("baseline saved:", args.baseline)
+    elif regressions:
+        print("\n{} regressions over the baseline:".format(len(regressions)))
+        for r in regressions:
+            print("  " + r)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
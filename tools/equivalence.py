@@ -0,0 +1,143 @@
+#-----------------------------------------------------------------------
+# Snake3D - render equivalence check
+# Copyright (C) 2026 ArcticDogsInc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+#-----------------------------------------------------------------------
+
+# The render shortcuts must not change a pixel: each one is played against the plain renderer
+# (full redraw, no culling, every cube rasterised) and the screens are compared after every tick:
+#
+#   python tools/equivalence.py                  # compare the modes, and with equivalence_baseline.json
+#   python tools/equivalence.py --save           # store the plain renderer's screens as the baseline
+#
+# Each mode is checked with both quad fills. The baseline holds the plain renderer's screens with
+# the diagonal line fill (SCANLINE_FILL = 0), the one of the first releases, so that a change to the
+# plain renderer itself is caught as well. The games are a scripted one, growing the snake from
+# the start, and long snakes following the bench's closed path, on the small and normal maps.
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+from autopilot import grid_path, step, key_for
+from backend import NumpyBackend
+from bench import place_snake
+from headless import load_engine, configure, new_game, tick
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "equivalence_baseline.json")
+TICKS = 20 # ticks per game, the baseline is for this many
+KEYS = (-1, -1, -1, 2, -1, -1, 7, -1, -1, -1, -1, 12, -1, -1, -1, 7, -1, 8) # the scripted game's, repeated
+GROWTH = 12 # cells the scripted snake is grown by at its third tick
+MODES = { # DIRTY_RENDER, CULLING_EN, SPRITES_EN
+    "plain": (0, 0, 0),
+    "dirty": (1, 0, 0),
+    "culling": (0, 1, 0),
+    "sprites": (0, 0, 1),
+    "all": (1, 1, 1),
+}
+
+def games():
+    # (dimensions, map size, shadows, perimeters, snake): snake is "script" or the part of the grid it covers
+    for dimensions, map_size, shadows, perimeters in ((3, 1, 2, 2), (3, 2, 1, 1), (3, 2, 2, 0), (2, 1, 0, 2), (2, 2, 0, 1)):
+        for snake in ("script", "1/3", "2/3"):
+            yield dimensions, map_size, shadows, perimeters, snake
+
+def game_name(settings):
+    dimensions, map_size, shadows, perimeters, snake = settings
+    return "{}D map {} shadows {} perimeters {} snake {}".format(dimensions, "SNL"[map_size - 1], shadows, perimeters, snake)
+
+def screens(settings, mode, scanline, ticks):
+    # hash of the screen after each tick
+    dimensions, map_size, shadows, perimeters, snake = settings
+    backend = NumpyBackend(seed=1)
+    engine = load_engine()
+    configure(engine, dimensions, shadows, map_size, 2, perimeters)
+    engine.DIRTY_RENDER, engine.CULLING_EN, engine.SPRITES_EN = MODES[mode]
+    engine.SCANLINE_FILL = scanline
+    game = new_game(engine, backend)
+    digests = []
+    if snake == "script":
+        for t in range(ticks):
+            tick(engine, game, backend, KEYS[t % len(KEYS)] if t else game.KEY_UP)
+            if t == 2:
+                for i in range(GROWTH):
+                    game.snake.grow()
+            digests.append(backend.digest())
+    else:
+        path = grid_path(engine)
+        length = len(path) * int(snake[0]) // int(snake[2])
+        place_snake(engine, game, path[:length])
+        for head in range(length - 1, length - 1 + ticks):
+            a, b = path[head % len(path)], path[(head + 1) % len(path)]
+            tick(engine, game, backend, key_for(game, game.snake.velocity, step(a, b)))
+            digests.append(backend.digest())
+    return digests
+
+def combined(digests):
+    return hashlib.sha1("".join(digests).encode()).hexdigest()
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the Snake3D render modes draw the same screens")
+    parser.add_argument("--ticks", type=int, default=TICKS)
+    parser.add_argument("--filter", default="", help="only the games whose name contains this text")
+    parser.add_argument("--save", action="store_true", help="store the plain renderer's screens as the baseline, at the default ticks")
+    parser.add_argument("--baseline", default=BASELINE)
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    mismatches = []
+    for settings in games():
+        name = game_name(settings)
+        if args.filter not in name:
+            continue
+        line = []
+        for scanline in (0, 1):
+            line.append("fill {}:".format(scanline))
+            plain = screens(settings, "plain", scanline, args.ticks)
+            if scanline == 0:
+                results[name] = combined(plain)
+                if args.ticks == TICKS and name in baseline and baseline[name] != results[name]:
+                    mismatches.append("{}: plain renderer differs from the baseline".format(name))
+            for mode in MODES:
+                if mode == "plain":
+                    continue
+                digests = screens(settings, mode, scanline, args.ticks)
+                ticks = [t for t in range(args.ticks) if digests[t] != plain[t]]
+                line.append("{}{}".format(mode, "=" if not ticks else "!"))
+                if ticks:
+                    mismatches.append("{} scanline {}: {} differs from plain from tick {} ({} ticks)".format(
+                        name, scanline, mode, ticks[0], len(ticks)))
+        print("{:<48} {}".format(name, " ".join(line)), flush=True)
+
+    if args.save and args.ticks == TICKS:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print("baseline saved:", args.baseline)
+    if mismatches:
+        print("\n{} mismatches:".format(len(mismatches)))
+        for m in mismatches:
+            print("  " + m)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#-----------------------------------------------------------------------
+# Snake3D - headless runner
+# Copyright (C) 2026 ArcticDogsInc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+#-----------------------------------------------------------------------
+
+# Runs the game of src/snake.py on the desktop with one of the backends of backend.py:
+#
+#   python tools/headless.py --ticks 300 --keys 0,0,8,0,0,2 --dump frames/
+#
+# Each tick is a Game.update() and a Game.draw(), with the key of the script for that tick
+# (-1 for none, the script is repeated). --digest prints a hash of the screen after each tick,
+# --profile the time spent in each phase of the ticks.
+
+import argparse
+import os
+import time
+import types
+
+from backend import Backend, NumpyBackend
+
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "snake.py")
+
+def load_engine(path=SOURCE):
+    # A fresh copy of the game module, with its own globals. The program file ends with its
+    # PPL launcher after #END, only the Python part is executed
+    with open(path) as f:
+        src = f.read().split("\n#END")[0]
+    engine = types.ModuleType("snake3d")
+    engine.__file__ = path
+    exec(compile(src, path, "exec"), engine.__dict__)
+    return engine
+
+def configure(engine, dimensions=3, shadows=1, map_size=2, speed=2, perimeters=2):
+    # what show_settings_menu() would set
+    engine.GAME_DIMENSIONS = dimensions
+    engine.SHADOWS_3D = shadows # SHADOWS_EN follows it in 3D only
+    engine.MAP_SIZE = map_size
+    engine.GAME_SPEED = speed
+    engine.PERIMETERS = perimeters
+    engine.apply_settings()
+
+def new_game(engine, backend, profile=False, rng=None):
+    # what Snake3D.__enter__ does after the settings menu, rng replacing the backend's generator
+    engine.use_backend(backend, rng or backend.random)
+    engine.ticks_us = lambda: int(time.perf_counter() * 1000000) # the profiler times the desktop run
+    engine.high_score = engine.HighScore()
+    backend.dimgrob(1, engine.SCREEN_W, engine.SCREEN_H, 0x0000)
+    backend.dimgrob(engine.SCRATCH_G, engine.SCREEN_W, engine.SCREEN_H, 0x0000)
+    game = engine.Game(engine.World(), engine.Snake(), engine.Prey())
+    if profile:
+        engine.PROFILE_EN = 1
+        engine.profiler = engine.Profiler(game.world)
+    return game
+
+def tick(engine, game, backend, key=-1, draw=True):
+    if key > 0:
+        backend.press(key)
+    engine.millis = backend.ticks()
+    game.update()
+    if draw:
+        game.draw()
+    if engine.profiler:
+        engine.profiler.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Snake3D without the calculator")
+    parser.add_argument("--dimensions", type=int, default=3, choices=(2, 3))
+    parser.add_argument("--shadows", type=int, default=1, choices=(0, 1, 2))
+    parser.add_argument("--map-size", type=int, default=2, choices=(1, 2, 3))
+    parser.add_argument("--speed", type=int, default=2, choices=(1, 2, 3))
+    parser.add_argument("--perimeters", type=int, default=2, choices=(0, 1, 2))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("--keys", default="-1", help="comma separated key codes, one per tick")
+    parser.add_argument("--no-pixels", action="store_true", help="count the draw calls without drawing them")
+    parser.add_argument("--digest", action="store_true", help="print a hash of the screen after each tick")
+    parser.add_argument("--dump", help="directory where the screen is saved as PPM after each tick")
+    parser.add_argument("--profile", action="store_true", help="print the time and calls of each phase of the last ticks")
+    parser.add_argument("--record", help="save the game as a replay, for tools/replay.py")
+    args = parser.parse_args()
+
+    backend = Backend(args.seed) if args.no_pixels else NumpyBackend(args.seed)
+    engine = load_engine()
+    configure(engine, args.dimensions, args.shadows, args.map_size, args.speed, args.perimeters)
+    recorder = None
+    if args.record:
+        recorder = engine.Replay(args.seed, (engine.GAME_DIMENSIONS, engine.SHADOWS_EN, engine.MAP_SIZE,
+                                             engine.GAME_SPEED, engine.PERIMETERS))
+    game = new_game(engine, backend, args.profile, engine.XorShift(args.seed) if recorder else None)
+    keys = [int(k) for k in args.keys.split(",")]
+    if args.dump:
+        os.makedirs(args.dump, exist_ok=True)
+
+    culled = [0, 0] # faces, edges
+    shadows = [0, 0] # fills, fills without the merging
+    latency = [] # ms each consumed key waited for its tick
+    for t in range(args.ticks):
+        tick(engine, game, backend, keys[t % len(keys)])
+        world = game.world
+        culled[0] += world.culled_faces
+        culled[1] += world.culled_edges
+        shadows[0] += world.shadow_fills
+        shadows[1] += world.shadow_fills_naive
+        if game.consumed_key > 0:
+            latency.append(game.key_latency_ms)
+        if recorder:
+            recorder.add(game.consumed_key)
+        if args.digest and not args.no_pixels:
+            print(t, backend.digest())
+        if args.dump and not args.no_pixels:
+            backend.save_ppm(os.path.join(args.dump, "{:05d}.ppm".format(t)))
+    print("state", game.state, "score", engine.score, "calls", backend.calls)
+    print("culled faces {} edges {}, shadow fills {} of {}, key latency mean {:.1f} max {} ms over {} keys".format(
+        culled[0], culled[1], shadows[0], shadows[1], sum(latency) / max(len(latency), 1), max(latency, default=0), len(latency)))
+    if recorder:
+        recorder.score, recorder.state = engine.score, game.state
+        recorder.save(args.record)
+    if args.profile:
+        print("phase      min us  mean us   max us  calls")
+        for p in range(len(engine.PHASE_NAMES)):
+            print("{:<8} {:>8} {:>8} {:>8} {:>6}".format(engine.PHASE_NAMES[p], *engine.profiler.stats(p)))
+        print("counter       min     mean      max")
+        for k in range(len(engine.COUNTER_NAMES)):
+            print("{:<8} {:>8} {:>8} {:>8}".format(engine.COUNTER_NAMES[k], *engine.profiler.counter_stats(k)))
+
+if __name__ == "__main__":
+    main()
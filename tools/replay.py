@@ -0,0 +1,84 @@
+#-----------------------------------------------------------------------
+# Snake3D - replay player
+# Copyright (C) 2026 ArcticDogsInc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+#-----------------------------------------------------------------------
+
+# Plays recorded sessions again: the snake3d.rpl file left by the game on the calculator when
+# REPLAY_EN is set, or the ones of headless.py --record.
+#
+#   python tools/replay.py games/*.rpl                        # headless, as fast as possible
+#   python tools/replay.py --realtime --dump frames/ snake3d.rpl
+#
+# The settings and the seed come from the record, and each tick gets the key the game consumed
+# then. The final score and state must be the recorded ones, otherwise the exit status is 1.
+
+import argparse
+import os
+import sys
+import time
+
+from backend import Backend, NumpyBackend
+from headless import load_engine, configure, new_game, tick
+
+def play(path, draw=False, realtime=False, dump=None):
+    # returns (replay, score, state, seconds)
+    engine = load_engine()
+    replay = engine.Replay.load(path)
+    dimensions, shadows, map_size, speed, perimeters = replay.settings
+    configure(engine, dimensions, shadows, map_size, speed, perimeters)
+    backend = NumpyBackend(realtime=realtime) if draw or dump else Backend(realtime=realtime)
+    game = new_game(engine, backend, rng=engine.XorShift(replay.seed))
+    step = engine.BASE_REFRESH_T_MS / engine.GAME_SPEED / 1000
+
+    start = time.perf_counter()
+    next_tick = start
+    for t in range(len(replay.keys)):
+        game.replay_key = replay.keys[t] or -1
+        tick(engine, game, backend, draw=draw or dump is not None)
+        if dump:
+            backend.save_ppm(os.path.join(dump, "{:06d}.ppm".format(t)))
+        if realtime:
+            next_tick += step
+            time.sleep(max(next_tick - time.perf_counter(), 0))
+    return replay, engine.score, game.state, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Play Snake3D replays again and check their outcome")
+    parser.add_argument("replays", nargs="+")
+    parser.add_argument("--draw", action="store_true", help="render the frames, needs NumPy")
+    parser.add_argument("--realtime", action="store_true", help="at the game speed instead of as fast as possible")
+    parser.add_argument("--dump", help="directory where the frames are saved as PPM, one replay only")
+    args = parser.parse_args()
+    if args.dump:
+        os.makedirs(args.dump, exist_ok=True)
+
+    failed = 0
+    ticks = 0
+    elapsed = 0
+    for path in args.replays:
+        replay, score, state, seconds = play(path, args.draw, args.realtime, args.dump)
+        ok = (score, state) == (replay.score, replay.state)
+        failed += not ok
+        ticks += len(replay.keys)
+        elapsed += seconds
+        print("{} {}: {} ticks, score {} state {}{}, {:.0f} ticks/s".format(
+            "ok" if ok else "MISMATCH", path, len(replay.keys), score, state,
+            "" if ok else " (recorded {} {})".format(replay.score, replay.state), len(replay.keys) / max(seconds, 1e-9)))
+    print("{} replays, {} failed, {} ticks in {:.2f} s".format(len(args.replays), failed, ticks, elapsed))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+#-----------------------------------------------------------------------
+# Snake3D - batch tournament runner
+# Copyright (C) 2026 ArcticDogsInc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+#-----------------------------------------------------------------------
+
+# Many whole games at once, on every core, for each high score table of the game (dimensions x
+# map size x speed):
+#
+#   python tools/tournament.py --games 50                     # random keys
+#   python tools/tournament.py --player autopilot --games 4 --max-ticks 50000 --jsonl games.jsonl
+#
+# Each game runs in a worker process with its own copy of the engine, the recording Backend and a
+# seed of its own: game i of each table is seeded with --seed + i, for the prey spawns (the
+# XorShift generator of the replays) as for the random keys. A game is thus the same whatever the
+# number of workers and the order they finish in, and --record saves it as a replay.
+# The results are printed as the games end, then gathered per table.
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import time
+
+from autopilot import Autopilot
+from backend import Backend
+from headless import load_engine, configure, new_game, tick
+
+PLAYERS = ("random", "autopilot", "keys")
+
+def tables():
+    # every get_hiscore_var_name() combination
+    for dimensions in (2, 3):
+        for map_size in (1, 2, 3):
+            for speed in (1, 2, 3):
+                yield dimensions, map_size, speed
+
+class RandomPlayer():
+    # a press of one of the arrows on a tick out of four
+    def __init__(self, game, seed):
+        self.game = game
+        self.rng = random.Random(seed)
+        self.keys = (game.KEY_UP, game.KEY_DOWN, game.KEY_LEFT, game.KEY_RIGHT)
+
+    def next_key(self):
+        if self.rng.randrange(4):
+            return -1
+        return self.keys[self.rng.randrange(4)]
+
+class ScriptPlayer():
+    # the keys of the script, one per tick and repeated, like headless.py --keys
+    def __init__(self, keys):
+        self.keys = keys
+        self.t = -1
+
+    def next_key(self):
+        self.t += 1
+        return self.keys[self.t % len(self.keys)]
+
+def play(job):
+    # one game, from the start key to the game over or max_ticks
+    dimensions, map_size, speed, seed, player, keys, max_ticks, draw, record = job
+    engine = load_engine()
+    configure(engine, dimensions, 1, map_size, speed)
+    name = engine.get_hiscore_var_name()
+    backend = Backend(seed)
+    recorder = None
+    if record:
+        recorder = engine.Replay(seed, (engine.GAME_DIMENSIONS, engine.SHADOWS_EN, engine.MAP_SIZE,
+                                        engine.GAME_SPEED, engine.PERIMETERS))
+    game = new_game(engine, backend, rng=engine.XorShift(seed))
+
+    if player == "autopilot":
+        pilot = Autopilot(engine, game)
+    elif player == "random":
+        pilot = RandomPlayer(game, seed)
+    else:
+        pilot = ScriptPlayer(keys)
+    ticks = 0
+    peak = game.snake.size
+    elapsed = 0
+    while ticks < max_ticks and game.state != game.State.GAME_OVER:
+        key = game.KEY_UP if game.state == game.State.READY else pilot.next_key()
+        t = time.perf_counter()
+        tick(engine, game, backend, key, draw)
+        elapsed += time.perf_counter() - t
+        ticks += 1
+        peak = max(peak, game.snake.size)
+        if recorder:
+            recorder.add(game.consumed_key)
+    if recorder:
+        recorder.score, recorder.state = engine.score, game.state
+        recorder.save(os.path.join(record, "{}_{}.rpl".format(name, seed)))
+
+    if game.state != game.State.GAME_OVER:
+        result = "timeout"
+    else:
+        result = "win" if game.prey.body == [] else "lost"
+    return {
+        "table": name,
+        "seed": seed,
+        "result": result,
+        "ticks": ticks,
+        "score": engine.score,
+        "peak_length": peak,
+        "cells": engine.cell_count(),
+        "ms_per_tick": round(elapsed * 1000 / max(ticks, 1), 4),
+        "game_s": round(ticks * engine.BASE_REFRESH_T_MS / speed / 1000, 1), # at the game speed
+    }
+
+def summary(games):
+    # one table's games, in seed order
+    scores = [g["score"] for g in games]
+    ticks = sum(g["ticks"] for g in games)
+    return {
+        "games": len(games),
+        "win": sum(g["result"] == "win" for g in games),
+        "lost": sum(g["result"] == "lost" for g in games),
+        "timeout": sum(g["result"] == "timeout" for g in games),
+        "score_min": min(scores),
+        "score_median": statistics.median(scores),
+        "score_mean": round(statistics.mean(scores), 2),
+        "score_max": max(scores),
+        "ticks_mean": round(ticks / len(games), 1),
+        "peak_length": max(g["peak_length"] for g in games),
+        "ms_per_tick": round(sum(g["ms_per_tick"] * g["ticks"] for g in games) / max(ticks, 1), 4),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Play many Snake3D games in parallel and report per high score table")
+    parser.add_argument("--games", type=int, default=20, help="games per table")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the first game of each table")
+    parser.add_argument("--player", default="random", choices=PLAYERS)
+    parser.add_argument("--keys", default="-1", help="comma separated key codes for --player keys, one per tick")
+    parser.add_argument("--max-ticks", type=int, default=20000, help="ticks after which a game is stopped")
+    parser.add_argument("--filter", default="", help="only the tables whose name contains this text, as SNAKE3D_HI_3D_M")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes, 1 to play in this one")
+    parser.add_argument("--no-draw", action="store_true", help="game logic only, no rendering")
+    parser.add_argument("--jsonl", help="file where each game's result is written as it ends")
+    parser.add_argument("--report", help="file where the per table report is saved as JSON")
+    parser.add_argument("--record", help="directory where each game is saved as a replay")
+    args = parser.parse_args()
+    if args.record:
+        os.makedirs(args.record, exist_ok=True)
+
+    keys = [int(k) for k in args.keys.split(",")]
+    jobs = []
+    for dimensions, map_size, speed in tables():
+        name = "SNAKE3D_HI_{}D_{}_{}".format(dimensions, "SML"[map_size - 1], "SNF"[speed - 1])
+        if args.filter not in name:
+            continue
+        for i in range(args.games):
+            jobs.append((dimensions, map_size, speed, args.seed + i, args.player, keys,
+                         args.max_ticks, not args.no_draw, args.record))
+    # the biggest grids first, so that no long game is left alone on one core at the end
+    jobs.sort(key=lambda job: (-job[0], -job[1]))
+
+    start = time.perf_counter()
+    out = open(args.jsonl, "w") if args.jsonl else None
+    results = []
+    pool = multiprocessing.Pool(args.workers) if args.workers > 1 else None
+    try:
+        for r in (pool.imap_unordered(play, jobs) if pool else map(play, jobs)):
+            results.append(r)
+            print("{:>5}/{} {} seed {}: {} score {} in {} ticks, peak length {}, {:.3f} ms/tick".format(
+                len(results), len(jobs), r["table"], r["seed"], r["result"], r["score"], r["ticks"],
+                r["peak_length"], r["ms_per_tick"]), flush=True)
+            if out:
+                out.write(json.dumps(r, sort_keys=True) + "\n")
+                out.flush()
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        if out:
+            out.close()
+    seconds = time.perf_counter() - start
+
+    report = {}
+    for r in sorted(results, key=lambda r: (r["table"], r["seed"])):
+        report.setdefault(r["table"], []).append(r)
+    for name in report:
+        report[name] = summary(report[name])
+    ticks = sum(r["ticks"] for r in results)
+
+    print("\n{:<22} {:>5} {:>4} {:>4} {:>4} {:>6} {:>6} {:>7} {:>6} {:>9} {:>6} {:>8}".format(
+        "table", "games", "win", "lost", "tout", "min", "median", "mean", "max", "ticks", "peak", "ms/tick"))
+    for name in sorted(report):
+        s = report[name]
+        print("{:<22} {:>5} {:>4} {:>4} {:>4} {:>6} {:>6} {:>7} {:>6} {:>9} {:>6} {:>8.3f}".format(
+            name, s["games"], s["win"], s["lost"], s["timeout"], s["score_min"], s["score_median"],
+            s["score_mean"], s["score_max"], s["ticks_mean"], s["peak_length"], s["ms_per_tick"]))
+    print("{} games, {} ticks in {:.1f} s on {} workers: {:.0f} ticks/s".format(
+        len(results), ticks, seconds, args.workers, ticks / max(seconds, 1e-9)))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+
+if __name__ == "__main__":
+    main()